@@ -1,12 +1,39 @@
-import streamlit as st
-import httpx
-import asyncio
-import csv
 import io
-import re
+import logging
 import time
 from typing import Optional
+import streamlit as st
 import pandas as pd
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from engine import (
+    DEFAULT_MARKET,
+    MARKETS,
+    PartialResult,
+    ResultTable,
+    aggregate_shops,
+    append_dataset,
+    attach_asins,
+    category_frame,
+    category_search,
+    category_tree,
+    create_asin_job,
+    create_specialist_job,
+    get_runtime,
+    job_frame,
+    keyword_search,
+    load_shop_list,
+    log,
+    parse_keywords,
+    pyarrow,
+    refreshing,
+    sales_velocity,
+    shop_item_velocity,
+    stage,
+    to_csv,
+    to_parquet,
+    track_run,
+)
 
 st.set_page_config(
     page_title="Shopee Research Tool",
@@ -68,137 +95,277 @@ div[data-testid="stTab"] {
 """, unsafe_allow_html=True)
 
 # ─────────────────────────────────────────────
-# Constants
+# Engine
 # ─────────────────────────────────────────────
-SHOPEE_BASE = "https://shopee.co.jp"
-SHOPEE_API = "https://shopee.co.jp/api/v4"
-
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36",
-    "Referer": "https://shopee.co.jp/",
-    "Accept": "application/json",
-    "X-API-SOURCE": "pc",
-    "X-Requested-With": "XMLHttpRequest",
-}
-
-SHOPEE_CATEGORIES = {
-    "Electronics（電子機器）": 11044906,
-    "Fashion（ファッション）": 11044914,
-    "Home & Living（ホーム）": 11044916,
-    "Sports & Outdoors（スポーツ）": 11044932,
-    "Toys & Games（おもちゃ）": 11044924,
-    "Baby & Kids（ベビー）": 11044956,
-    "Health & Beauty（美容）": 11044970,
-    "Food & Beverages（食品）": 11044972,
-    "Books & Stationery（本）": 11044982,
-    "Automotive（自動車）": 11044998,
-}
 
-# ─────────────────────────────────────────────
-# API Functions
-# ─────────────────────────────────────────────
+class StreamlitWarningHandler(logging.Handler):
+    """Show engine warnings in the page when they are raised from the script thread."""
+
+    def emit(self, record):
+        if get_script_run_ctx() is not None:
+            notice("warning", record.getMessage())
+
+@st.cache_resource
+def install_warning_handler():
+    log.addHandler(StreamlitWarningHandler(level=logging.WARNING))
+
+install_warning_handler()
+runtime = get_runtime()
+
+class ResultStream:
+    """Re-renders a results table in batches while rows arrive, with a partial-CSV download.
+
+    Batches accumulate in a ``ResultTable`` of ``kind``; ``frame(df)`` builds the
+    displayed table from everything collected so far.
+    """
+
+    def __init__(self, file_name: str, kind: str, frame=lambda df: df, every_rows: int = 100,
+                 every_seconds: float = 1.0):
+        self.file_name = file_name
+        self.frame = frame
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        self.rows = ResultTable(kind)
+        self._table = st.empty()
+        self._download = st.empty()
+        self._rendered = 0
+        self._rendered_at = 0.0
+        self._renders = 0
+
+    def extend(self, rows):
+        self.rows.append(rows)
+        if (len(self.rows) - self._rendered >= self.every_rows
+                or time.monotonic() - self._rendered_at >= self.every_seconds):
+            self.flush()
+
+    def flush(self):
+        if not len(self.rows):
+            return
+        with stage("render"):
+            self._flush()
+
+    def _flush(self):
+        df = self.frame(self.rows.frame())
+        self._table.dataframe(df, width="stretch")
+        self._renders += 1
+        self._download.download_button(
+            f"📥 途中経過CSV（{len(df)} 件）",
+            data=lambda: to_csv(df),
+            file_name=f"{self.file_name}_partial.csv",
+            mime="text/csv",
+            key=f"partial_{self.file_name}_{self._renders}",
+            on_click="ignore",
+        )
+        self._rendered = len(self.rows)
+        self._rendered_at = time.monotonic()
+
+    def finish(self, df: Optional[pd.DataFrame]):
+        """Show the final table in place of the partial one (or nothing for ``None``)."""
+        self._download.empty()
+        if df is None:
+            self._table.empty()
+        else:
+            with stage("render"):
+                self._table.dataframe(df, width="stretch")
+
+def download_buttons(df: pd.DataFrame, file_stem: str, key: str, label: str = "📥 CSV ダウンロード"):
+    """CSV download plus, when pyarrow is installed, the same table as Parquet.
+
+    Files are built when clicked, so a rerun over a large table doesn't serialize it.
+    """
+    col_csv, col_parquet = st.columns(2)
+    with col_csv:
+        st.download_button(label, data=lambda: to_csv(df), file_name=f"{file_stem}.csv", mime="text/csv",
+                           key=f"{key}_csv", on_click="ignore")
+    if pyarrow is not None:
+        with col_parquet:
+            st.download_button(
+                "📥 Parquet ダウンロード",
+                data=lambda: to_parquet(df),
+                file_name=f"{file_stem}.parquet",
+                mime="application/vnd.apache.parquet",
+                key=f"{key}_parquet",
+                on_click="ignore",
+            )
 
-def shopee_search(keyword: str, page: int = 0) -> dict:
-    params = {
-        "by": "sales",
-        "keyword": keyword,
-        "limit": 60,
-        "newest": page * 60,
-        "order": "desc",
-        "page_type": "search",
-        "scenario": "PAGE_GLOBAL_SEARCH",
-        "version": 2,
-    }
-    try:
-        with httpx.Client(headers=HEADERS, timeout=20) as client:
-            r = client.get(f"{SHOPEE_API}/search/search_items/", params=params)
-            return r.json() if r.status_code == 200 else {}
-    except Exception as e:
-        st.warning(f"API エラー: {e}")
-        return {}
-
-def shopee_category_search(category_id: int, page: int = 0) -> dict:
-    params = {
-        "by": "sales",
-        "limit": 60,
-        "newest": page * 60,
-        "order": "desc",
-        "catid": category_id,
-        "version": 2,
-    }
-    try:
-        with httpx.Client(headers=HEADERS, timeout=20) as client:
-            r = client.get(f"{SHOPEE_API}/search/search_items/", params=params)
-            return r.json() if r.status_code == 200 else {}
-    except Exception as e:
-        st.warning(f"API エラー: {e}")
-        return {}
-
-def get_shop_info(shop_id: int) -> dict:
-    try:
-        with httpx.Client(headers=HEADERS, timeout=20) as client:
-            r = client.get(f"{SHOPEE_API}/shop/get_shop_detail/", params={"shopid": shop_id})
-            return r.json().get("data", {}) if r.status_code == 200 else {}
-    except:
-        return {}
-
-def get_shop_items(shop_id: int, page: int = 0, limit: int = 100) -> list:
-    params = {
-        "shopid": shop_id,
-        "sort_by": "sales",
-        "order": "desc",
-        "limit": limit,
-        "offset": page * limit,
-        "filter_sold_out": 0,
-    }
-    try:
-        with httpx.Client(headers=HEADERS, timeout=20) as client:
-            r = client.get(f"{SHOPEE_API}/recommend/recommend_items/", params=params)
-            return r.json().get("items", []) if r.status_code == 200 else []
-    except:
-        return []
-
-def search_asin(title: str) -> Optional[str]:
-    clean = re.sub(r'[【】「」\[\]（）()]', ' ', title)
-    clean = ' '.join(clean.split()[:8])
-    try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36",
-            "Accept-Language": "ja-JP,ja;q=0.9",
-        }
-        with httpx.Client(headers=headers, timeout=15, follow_redirects=True) as client:
-            r = client.get("https://www.amazon.co.jp/s", params={"k": clean})
-            if r.status_code == 200:
-                asins = re.findall(r'/dp/([A-Z0-9]{10})', r.text)
-                if asins:
-                    return asins[0]
-    except:
-        pass
-    return None
-
-def parse_item(item: dict, japan_only: bool) -> Optional[dict]:
-    try:
-        basic = item.get("item_basic", {})
-        location = basic.get("shop_location", "")
-        if japan_only and location != "Japan":
-            return None
-        return {
-            "shop_name": basic.get("shop_name", ""),
-            "shop_id": basic.get("shopid", 0),
-            "shop_url": f"{SHOPEE_BASE}/{basic.get('shop_name', '')}",
-            "item_id": basic.get("itemid", 0),
-            "item_url": f"{SHOPEE_BASE}/{basic.get('shop_name', '')}-i.{basic.get('shopid', '')}.{basic.get('itemid', '')}",
-            "title": basic.get("name", ""),
-            "sold": basic.get("historical_sold", 0),
-            "price": basic.get("price", 0) / 100000,
-            "is_preferred": basic.get("is_preferred_plus_seller", False),
-            "location": location,
-        }
-    except:
-        return None
-
-def to_csv(df: pd.DataFrame) -> bytes:
-    return df.to_csv(index=False, encoding="utf-8-sig").encode("utf-8-sig")
+def perf_report(stats, key: str):
+    """Expander with the run's request and stage timings, downloadable as JSON."""
+    summary = stats.summary()
+    with st.expander("⏱️ パフォーマンス"):
+        col_time, col_requests, col_rate, col_cache = st.columns(4)
+        col_time.metric("所要時間", f"{summary['duration_s']} 秒")
+        col_requests.metric("リクエスト数", summary["requests"])
+        col_rate.metric("リクエスト/秒", summary["requests_per_s"])
+        ratio = summary["cache"]["http_hit_ratio"]
+        col_cache.metric("キャッシュヒット率", "-" if ratio is None else f"{ratio:.0%}")
+        if summary["endpoints"]:
+            st.dataframe(pd.DataFrame.from_dict(summary["endpoints"], orient="index"), width="stretch")
+        if summary["stages"]:
+            st.dataframe(pd.DataFrame.from_dict(summary["stages"], orient="index"), width="stretch")
+        st.download_button(
+            "📥 JSON",
+            data=stats.to_json(),
+            file_name=f"{key}.json",
+            mime="application/json",
+            key=key,
+            on_click="ignore",
+        )
+
+def notice(kind: str, text: str):
+    """``st.warning``, ``st.error`` or ``st.caption`` by ``kind``, shown again after
+    the rerun that ends a search run (see ``start_search``)."""
+    getattr(st, kind)(text)
+    if n := st.session_state.get("searching"):
+        st.session_state.setdefault(f"notices{n}", []).append((kind, text))
+
+def save_dataset(df: pd.DataFrame, name: str):
+    if append_to_dataset:
+        try:
+            path = append_dataset(df, name)
+        except ValueError as e:
+            notice("error", f"データセット `{name}` に追記できませんでした: {e}")
+            return
+        notice("caption", f"💾 データセット `{name}` に追記しました: {path}")
+
+def market_select(key: str) -> list:
+    """Markets to search at once; each gets its own rate budget."""
+    return st.multiselect(
+        "🌏 マーケット",
+        list(MARKETS),
+        default=[DEFAULT_MARKET],
+        format_func=lambda code: f"{MARKETS[code]['label']} ({code})",
+        key=key,
+        help="選択したマーケットを同時に検索し、結果をマーケット列付きで1つにまとめます",
+    )
+
+def memo(key: str, token, compute):
+    """``compute()``, kept in this session's state under ``key`` until ``token`` changes.
+
+    Popping ``key`` from ``st.session_state`` forces a recompute.
+    """
+    cached = st.session_state.get(key)
+    if cached is None or cached[0] != token:
+        cached = (token, compute())
+        st.session_state[key] = cached
+    return cached[1]
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def read_keywords(data: bytes) -> list:
+    """Keywords of an uploaded CSV, parsed once per distinct file."""
+    return parse_keywords(data.decode("utf-8-sig"))
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def read_shop_list(data: bytes) -> list:
+    """Shop URLs of an uploaded CSV, parsed once per distinct file."""
+    return load_shop_list(pd.read_csv(io.BytesIO(data)))
+
+def start_search(n: str):
+    """Search button callback: the run it triggers searches in tab ``n``.
+
+    A tab click reruns the script, which would cut an inline search short, so in
+    that run the tabs switch in the browser only; the run ends in a rerun that
+    hands them back.
+    """
+    st.session_state["searching"] = n
+
+def show_result(n: str):
+    """Tab ``n``'s last finished search, kept in the session until the next search or 🗑️."""
+    if not st.session_state.get("searching"):
+        for kind, text in st.session_state.pop(f"notices{n}", []):
+            getattr(st, kind)(text)
+    result = st.session_state.get(f"result{n}")
+    if result is None:
+        return
+    if result["error"]:
+        st.error(f"一部の検索に失敗したため結果は不完全です（データセットには追記していません）: {result['error']}")
+        st.warning(f"⚠️ {result['summary']}")
+    else:
+        st.success(f"✅ {result['summary']}")
+    for caption in result["captions"]:
+        st.caption(caption)
+    if result["df"] is not None:
+        with stage("render"):
+            st.dataframe(result["df"], width="stretch")
+        download_buttons(result["df"], result["file_stem"], key=f"dl{n}")
+    perf_report(result["stats"], key=f"perf{n}")
+    if st.button("🗑️ 結果をクリア", key=f"clear{n}"):
+        del st.session_state[f"result{n}"]
+        st.rerun()
+
+JOB_STATUS = {"pending": "待機", "running": "実行中", "interrupted": "中断", "done": "完了"}
+
+def job_panel(kind: str, file_prefix: str):
+    """Progress and rows of this session's job plus any other running jobs of ``kind``."""
+    runner = runtime.runner
+    shown = [j for j in [st.session_state.get(f"job_{kind}")] if j]
+    shown += [j for j in runner.active(kind) if j not in shown]
+
+    for job_id in shown:
+        job = runtime.jobs.get(job_id)
+        running = runner.is_running(job_id)
+        st.markdown(f"**ジョブ** `{job_id}` — {'実行中' if running else JOB_STATUS.get(job['status'], job['status'])}")
+        progress = runner.progress(job_id)
+        if progress:
+            if progress["error"]:
+                st.error(f"エラーで中断しました（再開できます）: {progress['error']}")
+            elif running:
+                st.progress(progress["fraction"], text=progress["text"])
+        if running and st.button("⏹ 停止", key=f"stop_{job_id}"):
+            runner.cancel(job_id)
+        df_job = memo(f"frame_{job_id}", (job["status"], job["updated_at"]), lambda: job_frame(job_id))
+        if len(df_job):
+            if not running and kind == "asin":
+                st.success(f"✅ 商品数: {len(df_job)} 件 / ASIN取得: {int((df_job['ASIN'] != '').sum())} 件")
+            elif not running:
+                st.success(f"✅ 専門店: {len(df_job)} 件見つかりました")
+            st.dataframe(df_job, width="stretch")
+            if running:
+                st.download_button(
+                    f"📥 途中経過CSV（{len(df_job)} 件）",
+                    data=lambda df=df_job: to_csv(df),
+                    file_name=f"{file_prefix}_partial.csv",
+                    mime="text/csv",
+                    key=f"dl_{job_id}",
+                    on_click="ignore",
+                )
+            else:
+                download_buttons(df_job, file_prefix, key=f"dl_{job_id}")
+        if progress and progress["stats"]:
+            perf_report(progress["stats"], key=f"perf_{job_id}")
+
+    with st.expander("📁 ジョブ履歴（再開・ダウンロード）"):
+        jobs = [j for j in runtime.jobs.list() if j["kind"] == kind]
+        if not jobs:
+            st.caption("ジョブはまだありません")
+            return
+        job = st.selectbox(
+            "ジョブ",
+            jobs,
+            format_func=lambda j: f"{j['job_id']} [{JOB_STATUS.get(j['status'], j['status'])}] {j['rows']} 行",
+            key=f"history_{kind}",
+        )
+        col_dl, col_resume = st.columns(2)
+        with col_dl:
+            if job["rows"]:
+                st.download_button(
+                    "📥 このジョブのCSV",
+                    data=lambda job_id=job["job_id"]: to_csv(job_frame(job_id)),
+                    file_name=f"{file_prefix}_{job['job_id']}.csv",
+                    mime="text/csv",
+                    key=f"dl_history_{kind}",
+                    on_click="ignore",
+                )
+        with col_resume:
+            if job["status"] != "done" and not runner.is_running(job["job_id"]):
+                if st.button("▶️ 再開", key=f"resume_{kind}"):
+                    st.session_state[f"job_{kind}"] = job["job_id"]
+                    runner.submit(job["job_id"])
+                    st.rerun()
+
+def render_job_panel(kind: str, file_prefix: str):
+    # Poll only while something is running; a finished job stops the refresh on the next full run
+    run_every = 2 if runtime.runner.active(kind) else None
+    st.fragment(run_every=run_every)(job_panel)(kind, file_prefix)
 
 # ─────────────────────────────────────────────
 # Header
@@ -210,15 +377,65 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# ─────────────────────────────────────────────
+# Sidebar
+# ─────────────────────────────────────────────
+with st.sidebar:
+    st.subheader("⚙️ 通信設定")
+    req_rate = st.number_input("Shopee 秒間リクエスト数（マーケットごと）", min_value=0.2, max_value=20.0, value=2.0, step=0.5)
+    max_in_flight = st.number_input("Shopee 最大同時リクエスト数（マーケットごと）", min_value=1, max_value=32, value=4)
+    runtime.configure_shopee(req_rate, max_in_flight)
+    vet_workers = st.number_input("店舗チェック並列数", min_value=1, max_value=32, value=4)
+    amazon_rate = st.number_input("Amazon 秒間リクエスト数", min_value=0.1, max_value=10.0, value=1.0, step=0.1)
+    amazon_in_flight = st.number_input("Amazon 最大同時リクエスト数", min_value=1, max_value=16, value=2)
+    runtime.amazon_limiter.configure(amazon_rate, amazon_in_flight)
+    limiters = [(f"Shopee {MARKETS[m]['label']}", limiter) for m, limiter in list(runtime.limiters.items())]
+    for name, limiter in limiters + [("Amazon", runtime.amazon_limiter)]:
+        if limiter.slowdown > 1:
+            st.caption(f"⚠️ {name}: エラー多発のため速度を 1/{limiter.slowdown:.0f} に制限中")
+
+    st.subheader("🗄️ キャッシュ")
+    force_refresh = st.toggle("🔄 強制再取得（キャッシュを使わない）", value=False)
+    incremental = st.toggle(
+        "♻️ 差分更新（前回から変わった分だけ取得）",
+        value=False,
+        help="前回の差分更新での同じ検索・店舗と重なった時点でページ取得を止め、最近チェックした店舗やタイトルが変わっていない商品のASINは再取得しません",
+    )
+    st.caption(f"キャッシュサイズ: {runtime.cache.size() / 1024 / 1024:.1f} MB")
+    if st.button("🗑️ キャッシュ削除", key="clear_cache"):
+        runtime.cache.clear()
+        st.rerun()
+
+    st.subheader("💾 データセット")
+    append_to_dataset = st.toggle(
+        "実行結果をParquetデータセットに追記",
+        value=False,
+        disabled=pyarrow is None,
+        help="結果を .shopee_research/datasets/<種類>/ にパーツファイルとして追加します",
+    )
+
 # ─────────────────────────────────────────────
 # Tabs
 # ─────────────────────────────────────────────
-tab1, tab2, tab3, tab4 = st.tabs([
+# Inputs render in every tab so they keep their values; results, job panels and
+# queries only run in the open one (while searching, the searching one)
+TABS = [
     "① キーワード検索",
     "② カテゴリ検索",
     "③ 専門店リサーチ",
     "④ ASIN抽出",
-])
+    "⑤ 売れ行き",
+]
+searching = st.session_state.get("searching")
+if searching:
+    tabs = st.tabs(TABS, key="tab", default=TABS[int(searching) - 1])
+else:
+    tabs = st.tabs(TABS, key="tab", on_change="rerun")
+tab1, tab2, tab3, tab4, tab5 = tabs
+
+def is_open(tab) -> bool:
+    return tab is tabs[int(searching) - 1] if searching else tab.open
+
 
 # ═══════════════════════════════════════════
 # ① キーワード検索
@@ -241,66 +458,50 @@ with tab1:
         min_sold = st.number_input("最低Sold数", min_value=0, value=1)
 
     min_products = st.number_input("最低商品数（0=制限なし）", min_value=0, value=0)
+    markets1 = market_select("m1")
 
-    if st.button("🔍 検索実行", key="btn1"):
+    if st.button("🔍 検索実行", key="btn1", on_click=start_search, args=("1",)):
         if not keyword:
-            st.warning("キーワードを入力してください")
+            notice("warning", "キーワードを入力してください")
+        elif not markets1:
+            notice("warning", "マーケットを選択してください")
         else:
-            shops = {}
-            items_list = []
-            progress = st.progress(0, text="検索中...")
-
-            for page in range(pages):
-                progress.progress((page + 1) / pages, text=f"ページ {page+1}/{pages} 検索中...")
-                data = shopee_search(keyword, page)
-                raw = data.get("items", [])
-                if not raw:
-                    break
-
-                for item in raw:
-                    parsed = parse_item(item, japan_only)
-                    if not parsed:
-                        continue
-                    if parsed["sold"] < min_sold:
-                        continue
-                    if preferred_only and not parsed["is_preferred"]:
-                        continue
-
-                    items_list.append(parsed)
-                    sid = parsed["shop_id"]
-                    if sid not in shops:
-                        shops[sid] = {
-                            "店舗名": parsed["shop_name"],
-                            "店舗URL": parsed["shop_url"],
-                            "Preferred": "⭐ YES" if parsed["is_preferred"] else "NO",
-                            "地域": parsed["location"],
-                            "総Sold数": 0,
-                            "商品数": 0,
-                        }
-                    shops[sid]["総Sold数"] += parsed["sold"]
-                    shops[sid]["商品数"] += 1
-
-                time.sleep(0.5)
-
-            progress.empty()
-
-            shop_list = list(shops.values())
-            if min_products > 0:
-                shop_list = [s for s in shop_list if s["商品数"] >= min_products]
-
-            shop_list.sort(key=lambda x: x["総Sold数"], reverse=True)
-
-            st.success(f"✅ 店舗数: {len(shop_list)} 件 / 商品数: {len(items_list)} 件")
-
-            if shop_list:
-                df = pd.DataFrame(shop_list)
-                st.dataframe(df, use_container_width=True)
-                st.download_button(
-                    "📥 CSV ダウンロード",
-                    data=to_csv(df),
-                    file_name=f"shopee_keyword_{keyword}.csv",
-                    mime="text/csv"
+            with track_run(f"keyword {keyword}") as stats1, refreshing(force_refresh):
+                progress = st.progress(0, text="検索中...")
+                stream = ResultStream(
+                    f"shopee_keyword_{keyword}", "item",
+                    frame=lambda items: aggregate_shops(items, min_products),
                 )
+                error1 = None
+                try:
+                    items_list = keyword_search(
+                        keyword, pages,
+                        japan_only=japan_only, preferred_only=preferred_only, min_sold=min_sold,
+                        on_page=lambda done, total: progress.progress(done / total, text=f"ページ {done}/{total} 検索中..."),
+                        on_batch=stream.extend,
+                        incremental=incremental,
+                        markets=markets1,
+                    )
+                except PartialResult as e:
+                    items_list, error1 = e.frame, str(e)
+                progress.empty()
+
+                df = aggregate_shops(items_list, min_products)
+                stream.finish(None)
+                # A partial result would pass for a complete one in the dataset
+                if not df.empty and error1 is None:
+                    save_dataset(df, "keyword_shops")
+            st.session_state["result1"] = {
+                "summary": f"店舗数: {len(df)} 件 / 商品数: {len(items_list)} 件",
+                "error": error1,
+                "captions": [],
+                "df": None if df.empty else df,
+                "file_stem": f"shopee_keyword_{keyword}",
+                "stats": stats1,
+            }
+
+    if is_open(tab1):
+        show_result("1")
 
 # ═══════════════════════════════════════════
 # ② カテゴリ検索
@@ -308,8 +509,30 @@ with tab1:
 with tab2:
     st.subheader("📂 カテゴリから商品を探す")
 
-    cat_label = st.selectbox("カテゴリ", list(SHOPEE_CATEGORIES.keys()))
-    cat_id = SHOPEE_CATEGORIES[cat_label]
+    col_market2, col_query2 = st.columns([1, 2])
+    with col_market2:
+        market2 = st.selectbox(
+            "🌏 マーケット",
+            list(MARKETS),
+            format_func=lambda code: f"{MARKETS[code]['label']} ({code})",
+            key="m2",
+            help="カテゴリIDはマーケットごとに異なるため、1つずつ検索します",
+        )
+    with col_query2:
+        query2 = st.text_input("カテゴリ検索（名前またはID）", placeholder="例: golf, sports ball, 11044932", key="q2")
+    # The category tree is fetched from the API, so it only loads while this tab is open;
+    # the chosen category is kept in "cat2" for when the tab opens again
+    tree2, cat_id = None, None
+    if is_open(tab2):
+        tree2 = category_tree(market2)
+        options2 = tree2.search(query2) if query2.strip() else tree2.roots
+        kept2 = st.session_state.get("cat2")
+        cat_id = st.selectbox(
+            "カテゴリ", options2, format_func=tree2.label,
+            index=options2.index(kept2) if kept2 in options2 else 0,
+        )
+        st.session_state["cat2"] = cat_id
+    cat_label = tree2.nodes[cat_id]["name"] if tree2 is not None and cat_id in tree2.nodes else str(cat_id)
 
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -319,57 +542,68 @@ with tab2:
     with col3:
         pages2 = st.number_input("検索ページ数", min_value=1, max_value=20, value=3, key="p2")
 
+    subtree2 = st.toggle(
+        "🌲 サブカテゴリをすべてクロール", value=False, key="s2",
+        help="配下の末端カテゴリをそれぞれ同時に検索し、重複する商品は1件にまとめます",
+    )
+    if subtree2 and tree2 is not None and cat_id is not None:
+        leaves2 = len(tree2.leaves(cat_id))
+        st.caption(f"末端カテゴリ {leaves2} 件 × {pages2} ページ = 最大 {leaves2 * pages2} リクエスト")
+
     extract_asin = st.toggle("🔗 ASIN抽出（Amazon検索・時間かかります）", value=False)
 
-    if st.button("🔍 カテゴリ検索", key="btn2"):
-        items_list2 = []
-        progress2 = st.progress(0, text="検索中...")
-
-        for page in range(pages2):
-            progress2.progress((page + 1) / pages2, text=f"ページ {page+1}/{pages2}...")
-            data = shopee_category_search(cat_id, page)
-            raw = data.get("items", [])
-            if not raw:
-                break
-
-            for item in raw:
-                parsed = parse_item(item, japan_only2)
-                if not parsed:
-                    continue
-                if parsed["sold"] < min_sold2:
-                    continue
-                items_list2.append(parsed)
-
-            time.sleep(0.5)
-
-        if extract_asin and items_list2:
-            asin_progress = st.progress(0, text="ASIN抽出中...")
-            for i, item in enumerate(items_list2):
-                asin_progress.progress((i + 1) / len(items_list2), text=f"ASIN抽出 {i+1}/{len(items_list2)}...")
-                asin = search_asin(item["title"])
-                item["asin"] = asin or ""
-                item["amazon_url"] = f"https://www.amazon.co.jp/dp/{asin}" if asin else ""
-                time.sleep(0.5)
-            asin_progress.empty()
-
-        progress2.empty()
-        st.success(f"✅ 商品数: {len(items_list2)} 件")
-
-        if items_list2:
-            df2 = pd.DataFrame(items_list2)
-            cols = ["title", "item_url", "sold", "price", "is_preferred", "shop_name"]
-            if extract_asin:
-                cols += ["asin", "amazon_url"]
-            df2 = df2[[c for c in cols if c in df2.columns]]
-            df2.columns = ["タイトル", "商品URL", "Sold", "価格(¥)", "Preferred", "店舗名"] + (["ASIN", "AmazonURL"] if extract_asin else [])
-
-            st.dataframe(df2, use_container_width=True)
-            st.download_button(
-                "📥 CSV ダウンロード",
-                data=to_csv(df2),
-                file_name=f"shopee_category_{cat_label}.csv",
-                mime="text/csv"
-            )
+    if st.button("🔍 カテゴリ検索", key="btn2", on_click=start_search, args=("2",)):
+        if cat_id is None:
+            notice("warning", "カテゴリを選択してください")
+        else:
+            with track_run(f"category {cat_id}") as stats2, refreshing(force_refresh):
+                progress2 = st.progress(0, text="検索中...")
+                captions2 = []
+                stream2 = ResultStream(f"shopee_category_{cat_label}", "item", frame=lambda items: category_frame(items, False))
+                error2 = None
+                try:
+                    items_list2 = category_search(
+                        cat_id, pages2,
+                        japan_only=japan_only2, min_sold=min_sold2,
+                        on_page=lambda done, total: progress2.progress(done / total, text=f"ページ {done}/{total}..."),
+                        on_batch=stream2.extend,
+                        incremental=incremental,
+                        market=market2,
+                        subtree=subtree2,
+                    )
+                except PartialResult as e:
+                    items_list2, error2 = e.frame, str(e)
+                stream2.flush()
+
+                if extract_asin and len(items_list2):
+                    asin_progress = st.progress(0, text="ASIN抽出中...")
+                    attach_asins(
+                        items_list2,
+                        on_progress=lambda done, total: asin_progress.progress(done / total, text=f"ASIN抽出 {done}/{total}..."),
+                        incremental=incremental,
+                    )
+                    asin_progress.empty()
+                    tiers = items_list2["asin_source"].value_counts()
+                    captions2.append(
+                        f"ASIN取得元: タイトル {tiers.get('title', 0)} / キャッシュ {tiers.get('cache', 0)} / "
+                        f"Amazon検索 {tiers.get('amazon', 0)} / 未解決 {tiers.get('', 0)}"
+                    )
+
+                progress2.empty()
+                stream2.finish(None)
+                if len(items_list2) and error2 is None:
+                    save_dataset(items_list2, "category_items")
+            st.session_state["result2"] = {
+                "summary": f"商品数: {len(items_list2)} 件",
+                "error": error2,
+                "captions": captions2,
+                "df": category_frame(items_list2, extract_asin) if len(items_list2) else None,
+                "file_stem": f"shopee_category_{cat_label}",
+                "stats": stats2,
+            }
+
+    if is_open(tab2):
+        show_result("2")
 
 # ═══════════════════════════════════════════
 # ③ 専門店リサーチ
@@ -386,8 +620,7 @@ with tab3:
         st.info("1行に1キーワードのCSVをアップロードしてください（例: golf, swimming, toys）")
         csv_file = st.file_uploader("CSVファイル", type=["csv"])
         if csv_file:
-            content = csv_file.read().decode("utf-8-sig")
-            keywords3 = [row.strip() for row in content.split("\n") if row.strip()]
+            keywords3 = read_keywords(csv_file.getvalue())
             st.write(f"キーワード数: {len(keywords3)} 件 → {', '.join(keywords3[:5])}...")
         else:
             keywords3 = []
@@ -407,105 +640,28 @@ with tab3:
         preferred_only3 = st.toggle("⭐ Preferredのみ", value=False, key="pref3")
     with col5:
         amazon_only = st.toggle("📦 Amazon仕入れのみ", value=True)
+    markets3 = market_select("m3")
 
     if st.button("🔍 専門店リサーチ開始", key="btn3"):
         if not keywords3:
             st.warning("キーワードを入力してください")
+        elif not markets3:
+            st.warning("マーケットを選択してください")
         else:
-            all_results = []
-
-            for kw_idx, kw in enumerate(keywords3):
-                st.write(f"🔍 **{kw}** を検索中... ({kw_idx+1}/{len(keywords3)})")
-                shops3 = {}
-                progress3 = st.progress(0)
-
-                for page in range(pages3):
-                    progress3.progress((page + 1) / pages3)
-                    data = shopee_search(kw, page)
-                    raw = data.get("items", [])
-                    if not raw:
-                        break
-
-                    for item in raw:
-                        parsed = parse_item(item, japan_only3)
-                        if not parsed:
-                            continue
-                        if parsed["sold"] < min_sold3:
-                            continue
-                        if preferred_only3 and not parsed["is_preferred"]:
-                            continue
-
-                        sid = parsed["shop_id"]
-                        if sid not in shops3:
-                            shops3[sid] = parsed
-
-                    time.sleep(0.5)
-
-                progress3.empty()
-
-                # Check each shop
-                checked = st.progress(0, text="店舗チェック中...")
-                shop_ids = list(shops3.keys())
-
-                for i, sid in enumerate(shop_ids):
-                    checked.progress((i + 1) / max(len(shop_ids), 1), text=f"店舗チェック {i+1}/{len(shop_ids)}...")
-                    shop = shops3[sid]
-
-                    # Get shop items to check categories & Amazon sourcing
-                    items = get_shop_items(sid, page=0, limit=50)
-                    if not items:
-                        continue
-
-                    # Category check (approximate using item data)
-                    cat_ids = set()
-                    amazon_count = 0
-                    for it in items:
-                        cats = it.get("categories", [])
-                        if cats:
-                            cat_ids.add(cats[0].get("catid", 0))
-                        title = it.get("name", "")
-                        if re.search(r'B0[A-Z0-9]{8}', title) or any(kw in title for kw in ["Amazon", "アマゾン"]):
-                            amazon_count += 1
-
-                    if len(cat_ids) > max_cats:
-                        continue
-                    if amazon_only and amazon_count < 1:
-                        continue
-
-                    # Get shop detail
-                    info = get_shop_info(sid)
-
-                    item_count = info.get("item_count", len(items))
-                    if min_products3 > 0 and item_count < min_products3:
-                        continue
-
-                    all_results.append({
-                        "検索キーワード": kw,
-                        "店舗名": shop["shop_name"],
-                        "店舗URL": shop["shop_url"],
-                        "Preferred": "⭐ YES" if shop["is_preferred"] else "NO",
-                        "カテゴリ数": len(cat_ids),
-                        "商品数": item_count,
-                        "フォロワー数": info.get("follower_count", 0),
-                        "レビュー数": info.get("rating_count", 0),
-                        "評価": round(info.get("rating_star", 0), 1),
-                    })
-                    time.sleep(0.3)
-
-                checked.empty()
-
-            st.success(f"✅ 専門店: {len(all_results)} 件見つかりました")
-
-            if all_results:
-                df3 = pd.DataFrame(all_results)
-                st.dataframe(df3, use_container_width=True)
-                st.download_button(
-                    "📥 CSV ダウンロード",
-                    data=to_csv(df3),
-                    file_name="shopee_specialist_shops.csv",
-                    mime="text/csv"
-                )
-                st.info("💡 このCSVを④ ASIN抽出タブに読み込ませると、全商品のASINを一括抽出できます")
+            job_id = create_specialist_job(
+                keywords3, pages3,
+                japan_only=japan_only3, preferred_only=preferred_only3, min_sold=min_sold3,
+                max_cats=max_cats, amazon_only=amazon_only, min_products=min_products3,
+                workers=vet_workers, dataset="specialist_shops" if append_to_dataset else None,
+                incremental=incremental, markets=markets3, force_refresh=force_refresh,
+            )
+            st.session_state["job_specialist"] = job_id
+            runtime.runner.submit(job_id)
+
+    if is_open(tab3):
+        render_job_panel("specialist", "shopee_specialist_shops")
+    if is_open(tab3) and st.session_state.get("job_specialist"):
+        st.info("💡 このCSVを④ ASIN抽出タブに読み込ませると、全商品のASINを一括抽出できます")
 
 # ═══════════════════════════════════════════
 # ④ ASIN抽出
@@ -521,18 +677,12 @@ with tab4:
     if input_mode4 == "CSVから読込（③の出力）":
         csv4 = st.file_uploader("CSVファイル（店舗URL列が必要）", type=["csv"], key="csv4")
         if csv4:
-            df_in = pd.read_csv(csv4)
-            url_col = None
-            for col in df_in.columns:
-                if "URL" in col or "url" in col:
-                    url_col = col
-                    break
-            if url_col:
-                shop_urls = df_in[url_col].dropna().tolist()
+            try:
+                shop_urls = read_shop_list(csv4.getvalue())
                 st.write(f"✅ {len(shop_urls)} 店舗を読み込みました")
                 st.write(shop_urls[:5])
-            else:
-                st.error("「URL」を含む列が見つかりません")
+            except ValueError as e:
+                st.error(str(e))
     else:
         urls_text = st.text_area("店舗URL（1行1URL）", placeholder="https://shopee.co.jp/shopname1\nhttps://shopee.co.jp/shopname2", height=150)
         shop_urls = [u.strip() for u in urls_text.split("\n") if u.strip()]
@@ -541,74 +691,43 @@ with tab4:
         st.write(f"対象店舗数: **{len(shop_urls)}** 件")
 
     if st.button("🔎 ASIN一括抽出開始", key="btn4") and shop_urls:
-        all_asins = []
-        total_progress = st.progress(0, text="ASIN抽出中...")
-
-        for shop_idx, shop_url in enumerate(shop_urls):
-            shop_name = shop_url.rstrip("/").split("/")[-1]
-            st.write(f"📦 **{shop_name}** の商品を取得中...")
-
-            # Get shop ID from search (simplified)
-            page = 0
-            shop_items = []
-            while True:
-                # Try to get items via recommendation API
-                # Need shop_id - extract from search
-                data = shopee_search(shop_name, 0)
-                raw = data.get("items", [])
-                found_id = None
-                for it in raw:
-                    basic = it.get("item_basic", {})
-                    if basic.get("shop_name", "") == shop_name:
-                        found_id = basic.get("shopid")
-                        break
-                if found_id:
-                    items = get_shop_items(found_id, page=page, limit=100)
-                    if not items:
-                        break
-                    shop_items.extend(items)
-                    page += 1
-                    if page > 5:
-                        break
-                    time.sleep(0.5)
-                else:
-                    break
-
-            item_progress = st.progress(0, text=f"{shop_name}: ASIN検索中...")
-            for i, item in enumerate(shop_items):
-                item_progress.progress((i + 1) / max(len(shop_items), 1))
-                title = item.get("name", "")
-                asin = search_asin(title)
-
-                all_asins.append({
-                    "店舗名": shop_name,
-                    "店舗URL": shop_url,
-                    "タイトル": title,
-                    "商品URL": f"{SHOPEE_BASE}/{shop_name}-i.{item.get('shopid','')}.{item.get('itemid','')}",
-                    "Sold": item.get("historical_sold", 0),
-                    "価格(¥)": item.get("price", 0) / 100000,
-                    "ASIN": asin or "",
-                    "Amazon URL": f"https://www.amazon.co.jp/dp/{asin}" if asin else "",
-                })
-                time.sleep(0.5)
-
-            item_progress.empty()
-            total_progress.progress((shop_idx + 1) / len(shop_urls))
-
-        total_progress.empty()
-
-        asin_found = len([a for a in all_asins if a["ASIN"]])
-        st.success(f"✅ 商品数: {len(all_asins)} 件 / ASIN取得: {asin_found} 件")
-
-        if all_asins:
-            df4 = pd.DataFrame(all_asins)
-            st.dataframe(df4, use_container_width=True)
-            st.download_button(
-                "📥 ASIN CSV ダウンロード",
-                data=to_csv(df4),
-                file_name="shopee_asins.csv",
-                mime="text/csv"
-            )
+        job_id = create_asin_job(shop_urls, dataset="asins" if append_to_dataset else None, incremental=incremental,
+                                 force_refresh=force_refresh)
+        st.session_state["job_asin"] = job_id
+        runtime.runner.submit(job_id)
+
+    if is_open(tab4):
+        render_job_panel("asin", "shopee_asins")
+
+# ═══════════════════════════════════════════
+# ⑤ 売れ行き
+# ═══════════════════════════════════════════
+with tab5:
+    st.subheader("📈 いま売れている店舗")
+
+    st.info("①〜④で取得した商品のSold数は毎日スナップショットとして保存されます。2日以上観測した商品から1日あたりの販売数を計算します")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        days5 = st.selectbox("集計期間", [3, 7, 14, 30], index=1, format_func=lambda d: f"直近 {d} 日")
+    with col2:
+        limit5 = st.number_input("表示店舗数", min_value=10, max_value=5000, value=200, step=10)
+
+    if is_open(tab5):
+        # Snapshots only move when a search runs, so the ranking is kept until asked for again
+        if st.button("🔄 再集計", key="refresh5"):
+            st.session_state.pop("velocity5", None)
+        df5 = memo("velocity5", (days5, limit5), lambda: sales_velocity(days5, limit5))
+        if df5.empty:
+            st.warning("比較できるスナップショットがまだありません。別の日に同じ検索を実行してください")
+        else:
+            st.dataframe(df5, width="stretch")
+            download_buttons(df5, f"shopee_velocity_{days5}d", key="dl5")
+
+            names5 = dict(zip(df5["店舗ID"], df5["店舗名"].fillna("")))
+            markets5 = dict(zip(df5["店舗ID"], df5["マーケット"].fillna(DEFAULT_MARKET)))
+            shop5 = st.selectbox("店舗の商品別内訳", list(names5), format_func=lambda sid: names5[sid] or str(sid))
+            st.dataframe(shop_item_velocity(shop5, days5, markets5[shop5]), width="stretch")
 
 # Footer
 st.markdown("---")
@@ -616,3 +735,10 @@ st.markdown(
     "<p style='text-align:center; color:#4a5568; font-size:0.75rem;'>Shopee Research Tool — For personal use only. Please respect Shopee's Terms of Service.</p>",
     unsafe_allow_html=True
 )
+
+if searching:
+    # The search is done: rerun so the tabs track state again, reopening the
+    # searching tab (the untracked tabs dropped their state)
+    del st.session_state["searching"]
+    st.session_state["tab"] = TABS[int(searching) - 1]
+    st.rerun()
@@ -0,0 +1,105 @@
+"""End-to-end timings of each tab's workflow against the local stand-in server.
+
+    python bench.py
+    python bench.py --latency 0.1 --error-rate 0.05 --rate 10 --json bench.json
+    python bench.py --only specialist --keywords 20
+    python bench.py --only keyword --only specialist --market jp --market sg --market my
+
+Every run starts from an empty data directory (so caches are cold) unless
+``--data-dir`` points at an existing one. The engine reads its base URLs and
+data directory at import, so they are set before ``engine`` is imported.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import mock_server
+
+BENCHMARKS = ["keyword", "category", "specialist", "asin", "velocity"]
+
+def bench_keyword(engine, args):
+    items = engine.keyword_search("golf", args.pages, markets=args.market)
+    engine.aggregate_shops(items, 0)
+
+def bench_category(engine, args):
+    tree = engine.category_tree()
+    items = engine.category_search(tree.roots[0], args.pages, subtree=True)
+    if len(items):
+        engine.attach_asins(items)
+
+def bench_specialist(engine, args):
+    keywords = [f"keyword {n:03d}" for n in range(args.keywords)]
+    job_id = engine.create_specialist_job(keywords, args.pages, japan_only=True, preferred_only=False, min_sold=1,
+                                          max_cats=1, amazon_only=True, min_products=0, workers=args.workers,
+                                          markets=args.market)
+    engine.run_specialist_job(job_id)
+
+def bench_asin(engine, args):
+    shop_ids = list(mock_server.SHOP_POOL)[:args.shops]
+    job_id = engine.create_asin_job([f"{engine.SHOPEE_BASE}/shop{sid}" for sid in shop_ids])
+    engine.run_asin_job(job_id)
+
+def bench_velocity(engine, args):
+    engine.sales_velocity(7)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the research workflows against a local mock server")
+    parser.add_argument("--only", choices=BENCHMARKS, action="append", help="run just these (repeatable)")
+    parser.add_argument("--latency", type=float, default=0.02, help="mean mock response delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of mock responses that are 429/503")
+    parser.add_argument("--replay", metavar="SQLITE", help="serve bodies recorded in this response cache first")
+    parser.add_argument("--rate", type=float, default=50.0, help="Shopee requests per second")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="Shopee concurrent requests")
+    parser.add_argument("--amazon-rate", type=float, default=50.0, help="Amazon requests per second")
+    parser.add_argument("--amazon-max-in-flight", type=int, default=8, help="Amazon concurrent requests")
+    parser.add_argument("--market", action="append", help="market to search in ① and ③, repeatable (default: jp)")
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--keywords", type=int, default=100, help="keywords in the specialist batch")
+    parser.add_argument("--shops", type=int, default=50, help="shops in the ASIN extraction")
+    parser.add_argument("--workers", type=int, default=4, help="parallel shop vetters")
+    parser.add_argument("--data-dir", help="reuse this data directory instead of a fresh one")
+    parser.add_argument("--json", metavar="PATH", help="write every run's report as JSON")
+    args = parser.parse_args(argv)
+
+    server = mock_server.serve(0, args.latency, args.error_rate, args.replay)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["SHOPEE_BASE_URL"] = base
+    os.environ["SHOPEE_API_URL"] = f"{base}/api/v4"
+    os.environ["AMAZON_BASE_URL"] = base
+    # The stand-in serves other markets under a path prefix
+    for market in args.market or []:
+        os.environ[f"SHOPEE_BASE_URL_{market.upper()}"] = f"{base}/{market}"
+    os.environ["SHOPEE_RESEARCH_DIR"] = args.data_dir or tempfile.mkdtemp(prefix="shopee-bench-")
+    import engine
+
+    unknown = set(args.market or []) - set(engine.MARKETS)
+    if unknown:
+        parser.error(f"unknown market: {', '.join(sorted(unknown))}")
+    runtime = engine.get_runtime()
+    runtime.configure_shopee(args.rate, args.max_in_flight)
+    runtime.amazon_limiter.configure(args.amazon_rate, args.amazon_max_in_flight)
+
+    reports = []
+    print(f"{'run':<12}{'wall s':>9}{'requests':>10}{'req/s':>8}{'p95 ms':>9}{'retries':>9}{'errors':>8}", file=sys.stderr)
+    for name in args.only or BENCHMARKS:
+        with engine.track_run(name) as stats:
+            globals()[f"bench_{name}"](engine, args)
+        report = stats.summary()
+        reports.append(report)
+        endpoints = report["endpoints"].values()
+        p95 = max((e["p95_ms"] for e in endpoints), default=0.0)
+        retries = sum(e["retries"] for e in endpoints)
+        errors = sum(e["errors"] for e in endpoints)
+        print(f"{name:<12}{report['duration_s']:>9.2f}{report['requests']:>10}{report['requests_per_s']:>8.1f}"
+              f"{p95:>9.1f}{retries:>9}{errors:>8}", file=sys.stderr)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(reports, ensure_ascii=False, indent=2), encoding="utf-8")
+    server.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
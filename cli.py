@@ -0,0 +1,224 @@
+"""Headless runner for the research workflows, e.g. from cron.
+
+    python cli.py keyword "golf club" --pages 5 -o golf.csv
+    python cli.py keyword "golf club" --market jp --market sg --market my
+    python cli.py category Electronics --asin
+    python cli.py category "sports golf" --subtree --pages 2
+    python cli.py specialist --keywords-file keywords.csv
+    python cli.py specialist --resume 20260101-120000-a1b2c3
+    python cli.py asin --csv shopee_specialist_shops.csv
+    python cli.py velocity --days 7
+
+Each subcommand mirrors one tab of the Streamlit app and runs on the same engine.
+"""
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+import engine
+
+def progress(label: str):
+    def report(done, total):
+        end = "\n" if done >= total else ""
+        print(f"\r{label} {done}/{total}", end=end, file=sys.stderr, flush=True)
+    return report
+
+def write_output(df: pd.DataFrame, args, stem: str, append: bool = True):
+    path = args.output or f"{stem}.{args.format}"
+    data = engine.to_parquet(df) if args.format == "parquet" else engine.to_csv(df)
+    Path(path).write_bytes(data)
+    print(f"{len(df)} 行 → {path}", file=sys.stderr)
+    if args.append_dataset and append:
+        try:
+            part = engine.append_dataset(df, args.append_dataset)
+        except ValueError as e:
+            raise SystemExit(f"not appended to dataset: {e}")
+        print(f"dataset {args.append_dataset} += {part}", file=sys.stderr)
+
+def write_partial(df: pd.DataFrame, args, stem: str, error: Exception):
+    """Keep what the searches that worked found, but fail the command and leave the dataset alone."""
+    write_output(df, args, stem, append=False)
+    raise SystemExit(f"incomplete result (dataset not appended): {error}")
+
+def resolve_category(value: str, market: str) -> int:
+    if value.isdigit():
+        return int(value)
+    tree = engine.category_tree(market)
+    matches = tree.search(value)
+    if matches:
+        return matches[0]
+    roots = ", ".join(tree.nodes[cat_id]["name"] for cat_id in tree.roots)
+    raise SystemExit(f"unknown category: {value} (top-level categories: {roots})")
+
+def cmd_keyword(args):
+    try:
+        items = engine.keyword_search(
+            args.keyword, args.pages,
+            japan_only=not args.all_locations, preferred_only=args.preferred_only, min_sold=args.min_sold,
+            on_page=progress("pages"), incremental=args.incremental, markets=args.market,
+        )
+    except engine.PartialResult as e:
+        write_partial(engine.aggregate_shops(e.frame, args.min_products), args, f"shopee_keyword_{args.keyword}", e)
+    shops = engine.aggregate_shops(items, args.min_products)
+    write_output(shops, args, f"shopee_keyword_{args.keyword}")
+
+def cmd_category(args):
+    if args.market and len(args.market) > 1:
+        raise SystemExit("category IDs differ per market: pass a single --market")
+    market = args.market[0] if args.market else engine.DEFAULT_MARKET
+    cat_id = resolve_category(args.category, market)
+    try:
+        items = engine.category_search(
+            cat_id, args.pages,
+            japan_only=not args.all_locations, min_sold=args.min_sold,
+            on_page=progress("pages"), incremental=args.incremental,
+            market=market, subtree=args.subtree,
+        )
+    except engine.PartialResult as e:
+        write_partial(engine.category_frame(e.frame, False), args, f"shopee_category_{cat_id}", e)
+    if args.asin and len(items):
+        engine.attach_asins(items, on_progress=progress("asin"), incremental=args.incremental)
+    if len(items):
+        write_output(engine.category_frame(items, args.asin), args, f"shopee_category_{cat_id}")
+
+def cmd_specialist(args):
+    if args.resume:
+        job_id = args.resume
+    else:
+        keywords = list(args.keywords)
+        if args.keywords_file:
+            keywords += engine.parse_keywords(Path(args.keywords_file).read_text(encoding="utf-8-sig"))
+        if not keywords:
+            raise SystemExit("no keywords given")
+        job_id = engine.create_specialist_job(
+            keywords, args.pages,
+            japan_only=not args.all_locations, preferred_only=args.preferred_only, min_sold=args.min_sold,
+            max_cats=args.max_cats, amazon_only=not args.include_non_amazon, min_products=args.min_products,
+            workers=args.workers, incremental=args.incremental, markets=args.market, force_refresh=args.force_refresh,
+        )
+    print(f"job {job_id} (resume with: --resume {job_id})", file=sys.stderr)
+
+    def on_event(kw, kind, payload):
+        if kind == "shop" and payload[1]:
+            print(f"[{kw}] {payload[1]['店舗名']}", file=sys.stderr)
+
+    engine.run_specialist_job(job_id, on_event=on_event)
+    write_output(engine.job_frame(job_id), args, "shopee_specialist_shops")
+
+def cmd_jobs(args):
+    store = engine.get_runtime().jobs
+    if args.export:
+        if store.get(args.export) is None:
+            raise SystemExit(f"unknown job: {args.export}")
+        write_output(engine.job_frame(args.export), args, f"shopee_{args.export}")
+        return
+    for job in store.list():
+        created = time.strftime("%Y-%m-%d %H:%M", time.localtime(job["created_at"]))
+        print(f"{job['job_id']}  {job['kind']:<10} {job['status']:<11} {job['rows']:>6} rows  {created}")
+
+def cmd_asin(args):
+    if args.resume:
+        job_id = args.resume
+    else:
+        shop_urls = list(args.shop_urls)
+        if args.csv:
+            shop_urls += engine.load_shop_list(pd.read_csv(args.csv))
+        if not shop_urls:
+            raise SystemExit("no shops given")
+        job_id = engine.create_asin_job(shop_urls, incremental=args.incremental, force_refresh=args.force_refresh)
+    print(f"job {job_id} (resume with: --resume {job_id})", file=sys.stderr)
+
+    def on_progress(fraction, text):
+        print(f"\r{fraction:6.1%} {text}", end="", file=sys.stderr, flush=True)
+
+    engine.run_asin_job(job_id, on_progress=on_progress)
+    print(file=sys.stderr)
+    write_output(engine.job_frame(job_id), args, "shopee_asins")
+
+def cmd_velocity(args):
+    write_output(engine.sales_velocity(args.days, args.limit), args, f"shopee_velocity_{args.days}d")
+
+def build_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-o", "--output", help="output path (defaults to the app's download file name)")
+    common.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    common.add_argument("--append-dataset", metavar="NAME", help="also append the rows to a local Parquet dataset")
+    common.add_argument("--rate", type=float, default=2.0, help="Shopee requests per second, per market")
+    common.add_argument("--max-in-flight", type=int, default=4, help="Shopee concurrent requests, per market")
+    common.add_argument("--amazon-rate", type=float, default=1.0, help="Amazon requests per second")
+    common.add_argument("--amazon-max-in-flight", type=int, default=2, help="Amazon concurrent requests")
+    common.add_argument("--force-refresh", action="store_true", help="ignore cached responses")
+    common.add_argument("--incremental", action="store_true", help="only fetch what changed since the last --incremental run")
+    common.add_argument("--perf-report", metavar="PATH", help="write the run's request/stage timings as JSON")
+    common.add_argument("-v", "--verbose", action="store_true")
+
+    search = argparse.ArgumentParser(add_help=False)
+    search.add_argument("--pages", type=int, default=3)
+    search.add_argument("--min-sold", type=int, default=1)
+    search.add_argument("--all-locations", action="store_true", help="include sellers outside Japan")
+    search.add_argument("--market", action="append", choices=list(engine.MARKETS),
+                        help=f"Shopee market to search, repeatable (default: {engine.DEFAULT_MARKET})")
+
+    parser = argparse.ArgumentParser(description="Shopee research tool (headless)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("keyword", parents=[common, search], help="① shops selling a keyword")
+    p.add_argument("keyword")
+    p.add_argument("--preferred-only", action="store_true")
+    p.add_argument("--min-products", type=int, default=0)
+    p.set_defaults(func=cmd_keyword)
+
+    p = sub.add_parser("category", parents=[common, search], help="② best sellers in a category")
+    p.add_argument("category", help="category ID or words of its name (e.g. \"sports golf\")")
+    p.add_argument("--subtree", action="store_true", help="search every leaf category under it, --pages each")
+    p.add_argument("--asin", action="store_true", help="also look up ASINs on Amazon")
+    p.set_defaults(func=cmd_category)
+
+    p = sub.add_parser("specialist", parents=[common, search], help="③ Amazon-sourcing specialist shops")
+    p.add_argument("keywords", nargs="*")
+    p.add_argument("--keywords-file", help="one keyword per line")
+    p.add_argument("--max-cats", type=int, default=1)
+    p.add_argument("--min-products", type=int, default=0)
+    p.add_argument("--preferred-only", action="store_true")
+    p.add_argument("--include-non-amazon", action="store_true")
+    p.add_argument("--workers", type=int, default=4, help="parallel shop vetters")
+    p.add_argument("--resume", metavar="JOB_ID", help="continue an interrupted job")
+    p.set_defaults(func=cmd_specialist)
+
+    p = sub.add_parser("asin", parents=[common], help="④ ASINs for every item of the given shops")
+    p.add_argument("shop_urls", nargs="*")
+    p.add_argument("--csv", help="CSV with a URL column (e.g. the specialist output)")
+    p.add_argument("--resume", metavar="JOB_ID", help="continue an interrupted job")
+    p.set_defaults(func=cmd_asin)
+
+    p = sub.add_parser("velocity", parents=[common], help="⑤ shops ranked by recent sold-per-day")
+    p.add_argument("--days", type=int, default=7, help="window of snapshots to compare")
+    p.add_argument("--limit", type=int, default=500)
+    p.set_defaults(func=cmd_velocity)
+
+    p = sub.add_parser("jobs", parents=[common], help="list checkpointed jobs or export one")
+    p.add_argument("--export", metavar="JOB_ID", help="write the job's rows to CSV")
+    p.set_defaults(func=cmd_jobs)
+
+    return parser
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(levelname)s %(message)s")
+
+    runtime = engine.get_runtime()
+    runtime.configure_shopee(args.rate, args.max_in_flight)
+    runtime.amazon_limiter.configure(args.amazon_rate, args.amazon_max_in_flight)
+
+    with engine.track_run(args.command) as stats, engine.refreshing(args.force_refresh):
+        args.func(args)
+    if args.perf_report:
+        Path(args.perf_report).write_bytes(stats.to_json())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
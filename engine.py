@@ -0,0 +1,2441 @@
+"""Research engine behind the Streamlit app and the CLI.
+
+Fetching, caching, filtering and aggregation for the four research workflows
+(keyword, category, specialist shops, ASIN extraction) live here, with no UI
+dependency, so the same code runs in a browser session or unattended.
+"""
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Optional
+
+import httpx
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (enables Parquet export)
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+log = logging.getLogger("shopee_research")
+
+# ─────────────────────────────────────────────
+# Constants
+# ─────────────────────────────────────────────
+# Shopee markets by code. Each market's host gets its own connection pool and rate
+# budget; prices come back in the market's own currency.
+DEFAULT_MARKET = "jp"
+MARKETS = {
+    "jp": {"label": "日本", "base": "https://shopee.co.jp", "currency": "JPY"},
+    "sg": {"label": "シンガポール", "base": "https://shopee.sg", "currency": "SGD"},
+    "my": {"label": "マレーシア", "base": "https://shopee.com.my", "currency": "MYR"},
+    "tw": {"label": "台湾", "base": "https://shopee.tw", "currency": "TWD"},
+    "th": {"label": "タイ", "base": "https://shopee.co.th", "currency": "THB"},
+    "ph": {"label": "フィリピン", "base": "https://shopee.ph", "currency": "PHP"},
+    "vn": {"label": "ベトナム", "base": "https://shopee.vn", "currency": "VND"},
+    "id": {"label": "インドネシア", "base": "https://shopee.co.id", "currency": "IDR"},
+    "br": {"label": "ブラジル", "base": "https://shopee.com.br", "currency": "BRL"},
+}
+
+# Overridable so the benchmark harness can point the engine at its local stand-in
+# server: SHOPEE_BASE_URL / SHOPEE_API_URL for the default market,
+# SHOPEE_BASE_URL_<CODE> / SHOPEE_API_URL_<CODE> for the others
+for _code, _market in MARKETS.items():
+    _suffix = "" if _code == DEFAULT_MARKET else f"_{_code.upper()}"
+    _market["base"] = os.environ.get(f"SHOPEE_BASE_URL{_suffix}", _market["base"])
+    _market["api"] = os.environ.get(f"SHOPEE_API_URL{_suffix}", f"{_market['base']}/api/v4")
+
+SHOPEE_BASE = MARKETS[DEFAULT_MARKET]["base"]
+AMAZON_BASE = os.environ.get("AMAZON_BASE_URL", "https://www.amazon.co.jp")
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36",
+    "Referer": f"{SHOPEE_BASE}/",
+    "Accept": "application/json",
+    "X-API-SOURCE": "pc",
+    "X-Requested-With": "XMLHttpRequest",
+}
+
+AMAZON_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36",
+    "Accept-Language": "ja-JP,ja;q=0.9",
+}
+
+DATA_DIR = Path(os.environ.get("SHOPEE_RESEARCH_DIR", ".shopee_research"))
+
+# Seconds a cached response stays fresh, per endpoint; endpoints not listed are never cached
+CACHE_TTL = {
+    "/search/search_items/": 30 * 60,
+    "/recommend/recommend_items/": 2 * 60 * 60,
+    "/shop/get_shop_detail/": 12 * 60 * 60,
+    "/pages/get_category_tree": 7 * 24 * 60 * 60,
+}
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CATALOG_PAGE_SIZE = 100
+
+HTTP_RETRIES = 3
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_AFTER_MAX = 120
+
+# Circuit breaker: when at least BREAKER_MIN_ERRORS of the requests in the last
+# BREAKER_WINDOW seconds failed and they make up BREAKER_THRESHOLD of them, the
+# limiter pauses for BREAKER_COOLDOWN and halves its rate (down to 1/BREAKER_MAX_SLOWDOWN)
+BREAKER_WINDOW = 30.0
+BREAKER_THRESHOLD = 0.5
+BREAKER_MIN_ERRORS = 5
+BREAKER_COOLDOWN = 10.0
+BREAKER_MAX_SLOWDOWN = 16
+
+# Found ASINs rarely change; misses are retried sooner in case Amazon starts listing the product
+ASIN_TTL = 30 * 24 * 60 * 60
+ASIN_MISS_TTL = 24 * 60 * 60
+
+# Incremental refresh: stop paging once this share of a page was in the last run,
+# and reuse a shop's vetting result while it is younger than the refresh age
+OVERLAP_STOP = 0.9
+VET_REFRESH_AGE = 7 * 24 * 60 * 60
+# Stored runs (the baselines of incremental refresh) expire once the oldest data they
+# carry forward is RUN_MAX_AGE old, forcing a full refetch, and the oldest are
+# dropped once together they take more than RUN_MAX_BYTES
+RUN_MAX_AGE = 7 * 24 * 60 * 60
+RUN_MAX_BYTES = 64 * 1024 * 1024
+
+# Shop profiles cover up to PROFILE_MAX_PAGES catalog pages and are rebuilt
+# (incrementally) once older than PROFILE_REFRESH_AGE. A category counts towards
+# max_cats only above CATEGORY_MIN_SHARE of the catalog, so a few stray listings
+# don't disqualify an otherwise specialised shop.
+PROFILE_MAX_PAGES = 20
+PROFILE_REFRESH_AGE = 7 * 24 * 60 * 60
+CATEGORY_MIN_SHARE = 0.05
+
+# A tree that failed to load is retried after CATEGORY_TREE_RETRY seconds;
+# meanwhile the default market falls back to the top-level SHOPEE_CATEGORIES
+CATEGORY_TREE_RETRY = 5 * 60
+
+SHOPEE_CATEGORIES = {
+    "Electronics（電子機器）": 11044906,
+    "Fashion（ファッション）": 11044914,
+    "Home & Living（ホーム）": 11044916,
+    "Sports & Outdoors（スポーツ）": 11044932,
+    "Toys & Games（おもちゃ）": 11044924,
+    "Baby & Kids（ベビー）": 11044956,
+    "Health & Beauty（美容）": 11044970,
+    "Food & Beverages（食品）": 11044972,
+    "Books & Stationery（本）": 11044982,
+    "Automotive（自動車）": 11044998,
+}
+
+# ─────────────────────────────────────────────
+# Markets
+# ─────────────────────────────────────────────
+
+def scoped(market: str, key: str) -> str:
+    """``key`` namespaced by ``market`` for the name- and query-keyed stores.
+
+    Default-market keys stay bare, so stores written before markets existed keep
+    matching. Shop and item IDs are unique across Shopee markets and need no scope.
+    """
+    return key if market == DEFAULT_MARKET else f"{market}:{key}"
+
+def market_from_url(url: str) -> str:
+    """The market whose site ``url`` is on; anything else counts as the default market."""
+    def bare(u):
+        return re.sub(r"^https?://(www\.)?", "", u.strip())
+
+    target = bare(url)
+    # Longest base first: a stand-in market may be served under another's base URL
+    for code, market in sorted(MARKETS.items(), key=lambda m: -len(m[1]["base"])):
+        base = bare(market["base"])
+        if target == base or target.startswith(base + "/"):
+            return code
+    return DEFAULT_MARKET
+
+# ─────────────────────────────────────────────
+# Instrumentation
+# ─────────────────────────────────────────────
+
+class RunStats:
+    """Timings of one run: every outbound request, cache outcomes and pipeline stages.
+
+    Requests are recorded on the loop thread and stages on whichever thread runs
+    them, so every write takes the lock. ``summary`` condenses it all into the
+    run report.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.finished = None
+        self.requests = []
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def request(self, endpoint: str, *, status=None, latency: float = 0.0, wait: float = 0.0,
+                size: int = 0, retries: int = 0, cache: str = "none"):
+        with self._lock:
+            self.requests.append({
+                "endpoint": endpoint, "status": status, "latency": latency, "wait": wait,
+                "bytes": size, "retries": retries, "cache": cache,
+            })
+
+    def stage_time(self, name: str, seconds: float):
+        with self._lock:
+            total, calls = self.stages.get(name, (0.0, 0))
+            self.stages[name] = (total + seconds, calls + 1)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self) -> dict:
+        with self._lock:
+            requests = pd.DataFrame(self.requests, columns=["endpoint", "status", "latency", "wait", "bytes", "retries", "cache"])
+            stages = dict(self.stages)
+            counters = dict(self.counters)
+        duration = (self.finished or time.time()) - self.started
+        network = requests[requests["cache"] != "hit"]
+        hits = int((requests["cache"] == "hit").sum())
+        misses = int((requests["cache"] == "miss").sum())
+
+        endpoints = {}
+        for endpoint, group in network.groupby("endpoint"):
+            latency_ms = group["latency"] * 1000
+            endpoints[endpoint] = {
+                "requests": len(group),
+                "errors": int((group["status"] != 200).sum()),
+                "retries": int(group["retries"].sum()),
+                "p50_ms": round(latency_ms.quantile(0.5), 1),
+                "p95_ms": round(latency_ms.quantile(0.95), 1),
+                "max_ms": round(latency_ms.max(), 1),
+                "mean_wait_ms": round(group["wait"].mean() * 1000, 1),
+                "bytes": int(group["bytes"].sum()),
+            }
+        return {
+            "run": self.name,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "duration_s": round(duration, 2),
+            "requests": len(network),
+            "requests_per_s": round(len(network) / duration, 2) if duration > 0 else 0.0,
+            "wait_s": round(float(network["wait"].sum()), 2),
+            "cache": {
+                "http_hits": hits,
+                "http_misses": misses,
+                "http_hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None,
+                **{name: n for name, n in sorted(counters.items()) if name.startswith("asin_")},
+            },
+            "endpoints": endpoints,
+            "stages": {name: {"seconds": round(total, 3), "calls": calls} for name, (total, calls) in sorted(stages.items())},
+        }
+
+    def to_json(self) -> bytes:
+        return json.dumps(self.summary(), ensure_ascii=False, indent=2).encode("utf-8")
+
+# The run being measured; the loop thread sees the caller's run because
+# run_coroutine_threadsafe copies the calling thread's context into the task
+_current_run = contextvars.ContextVar("shopee_research_run", default=None)
+
+def current_run() -> Optional[RunStats]:
+    return _current_run.get()
+
+@contextmanager
+def track_run(name: str):
+    """Measure everything the calling thread does inside the block as one run."""
+    stats = RunStats(name)
+    token = _current_run.set(stats)
+    try:
+        yield stats
+    finally:
+        stats.finished = time.time()
+        _current_run.reset(token)
+
+# Whether the current run bypasses the response and ASIN caches; per run, like
+# _current_run, so one session's or job's setting doesn't leak into the others
+_force_refresh = contextvars.ContextVar("shopee_research_force_refresh", default=False)
+
+@contextmanager
+def refreshing(enabled: bool = True):
+    """Refetch instead of reading the caches for everything inside the block, when ``enabled``."""
+    token = _force_refresh.set(_force_refresh.get() or enabled)
+    try:
+        yield
+    finally:
+        _force_refresh.reset(token)
+
+@contextmanager
+def stage(name: str):
+    """Add the block's wall time to stage ``name`` of the current run, if any."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current_run.get()
+        if stats:
+            stats.stage_time(name, time.perf_counter() - start)
+
+# ─────────────────────────────────────────────
+# HTTP Client
+# ─────────────────────────────────────────────
+
+class FetchError(Exception):
+    """A request that still failed after its retries, as opposed to an empty result."""
+
+class PartialResult(FetchError):
+    """Some of a search's queries failed; ``frame`` holds what the others found."""
+
+    def __init__(self, message: str, frame: pd.DataFrame):
+        super().__init__(message)
+        self.frame = frame
+
+class RateLimiter:
+    """Token bucket (requests per second) combined with a cap on in-flight requests.
+
+    Shopee and Amazon each get one process-wide instance; ``configure`` can retune
+    it between runs without recreating waiters. Its ``breaker`` may divide the rate
+    by ``slowdown`` and pause new requests until ``paused_until``.
+    """
+
+    def __init__(self, rate: float, max_in_flight: int):
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.slowdown = 1.0
+        self.paused_until = 0.0
+        self.breaker = CircuitBreaker(self)
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._bucket_lock = asyncio.Lock()
+        self._slots = asyncio.Condition()
+
+    def configure(self, rate: float, max_in_flight: int):
+        self.rate = max(rate, 0.01)
+        self.max_in_flight = max(int(max_in_flight), 1)
+
+    async def _take_token(self):
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                rate = self.rate / self.slowdown
+                capacity = max(1.0, rate)
+                self._tokens = min(capacity, self._tokens + (now - self._updated) * rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / rate)
+
+    async def __aenter__(self):
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_flight < self.max_in_flight)
+            self._in_flight += 1
+        try:
+            await self._take_token()
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._slots:
+            self._in_flight -= 1
+            self._slots.notify_all()
+
+class CircuitBreaker:
+    """Slows its limiter down while recent requests keep failing, then lets it recover.
+
+    Tripping halves the rate and pauses new requests for ``BREAKER_COOLDOWN``; after
+    each following error-free ``BREAKER_WINDOW`` the rate doubles back towards the
+    configured one.
+    """
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+        self._outcomes = deque()
+        self._changed_at = 0.0
+
+    def record(self, ok: bool):
+        now = time.monotonic()
+        self._outcomes.append((now, ok))
+        while self._outcomes[0][0] < now - BREAKER_WINDOW:
+            self._outcomes.popleft()
+        errors = sum(1 for _, good in self._outcomes if not good)
+        limiter = self.limiter
+        if not ok:
+            if (errors >= BREAKER_MIN_ERRORS and errors >= BREAKER_THRESHOLD * len(self._outcomes)
+                    and now - self._changed_at >= BREAKER_COOLDOWN):
+                limiter.slowdown = min(limiter.slowdown * 2, BREAKER_MAX_SLOWDOWN)
+                limiter.paused_until = now + BREAKER_COOLDOWN
+                self._changed_at = now
+                self._outcomes.clear()
+                log.warning(f"エラーが多発しているため {BREAKER_COOLDOWN:.0f} 秒停止し、速度を 1/{limiter.slowdown:.0f} に落とします")
+        elif limiter.slowdown > 1 and errors == 0 and now - self._changed_at >= BREAKER_WINDOW:
+            limiter.slowdown = max(limiter.slowdown / 2, 1.0)
+            self._changed_at = now
+
+def retry_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    """Jittered exponential backoff, stretched to the server's ``Retry-After`` when given."""
+    delay = 2 ** attempt + random.random()
+    header = response.headers.get("Retry-After") if response is not None else None
+    if header:
+        try:
+            wait = float(header)
+        except ValueError:
+            try:
+                wait = parsedate_to_datetime(header).timestamp() - time.time()
+            except (TypeError, ValueError):
+                wait = 0
+        delay = max(delay, min(wait, RETRY_AFTER_MAX))
+    return delay
+
+async def http_get(client: httpx.AsyncClient, limiter: RateLimiter, url: str, params: dict,
+                   endpoint: str, cache: str = "none") -> httpx.Response:
+    """GET through ``limiter``, retrying transport errors and ``RETRY_STATUSES``.
+
+    Returns any other response (including non-200s) and raises ``FetchError`` once
+    ``HTTP_RETRIES`` retries are used up. Every attempt is reported to the
+    limiter's circuit breaker, and the request as a whole to the current run
+    under ``endpoint``: latency of the last attempt, time spent waiting on the
+    limiter and backoff, status, size and retries.
+    """
+    failure = None
+    wait = latency = 0.0
+    status = None
+    r = None
+    for attempt in range(HTTP_RETRIES + 1):
+        queued = time.perf_counter()
+        try:
+            async with limiter:
+                sent = time.perf_counter()
+                wait += sent - queued
+                r = await client.get(url, params=params)
+        except httpx.TransportError as e:
+            latency = time.perf_counter() - sent
+            limiter.breaker.record(False)
+            failure = f"{type(e).__name__}: {e}"
+            delay = retry_delay(attempt)
+        else:
+            latency = time.perf_counter() - sent
+            status = r.status_code
+            if r.status_code not in RETRY_STATUSES:
+                limiter.breaker.record(True)
+                break
+            limiter.breaker.record(False)
+            failure = f"HTTP {r.status_code}"
+            delay = retry_delay(attempt, r)
+        r = None
+        if attempt < HTTP_RETRIES:
+            await asyncio.sleep(delay)
+            wait += delay
+    stats = _current_run.get()
+    if stats:
+        stats.request(endpoint, status=status, latency=latency, wait=wait,
+                      size=len(r.content) if r is not None else 0, retries=attempt, cache=cache)
+    if r is None:
+        raise FetchError(f"{url}: {failure}（{HTTP_RETRIES} 回再試行）")
+    return r
+
+class ResponseCache:
+    """On-disk cache of compressed JSON responses keyed by endpoint and normalized params.
+
+    Entries expire after the endpoint's ``CACHE_TTL``; once the store grows past
+    ``max_bytes`` the least recently read entries are evicted.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = CACHE_MAX_BYTES):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at)")
+        self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(endpoint: str, params: dict) -> str:
+        normalized = {k: str(v) for k, v in params.items() if v is not None}
+        return endpoint + "?" + json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+
+    def get(self, endpoint: str, params: dict, market: str = DEFAULT_MARKET) -> Optional[dict]:
+        ttl = CACHE_TTL.get(endpoint)
+        if not ttl or _force_refresh.get():
+            return None
+        key = scoped(market, self.key(endpoint, params))
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT body, fetched_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            if now - row[1] > ttl:
+                self._delete(key)
+                return None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, endpoint: str, params: dict, body: bytes, market: str = DEFAULT_MARKET):
+        if endpoint not in CACHE_TTL:
+            return
+        key = scoped(market, self.key(endpoint, params))
+        blob = zlib.compress(body)
+        now = time.time()
+        with self._lock:
+            self._delete(key)
+            self._db.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, blob, len(blob), now, now),
+            )
+            self._total += len(blob)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def size(self) -> int:
+        return self._total
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._total = 0
+
+    def _delete(self, key: str):
+        row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total -= row[0]
+
+    def _evict(self):
+        # Trim to 90% so a full cache doesn't evict on every write
+        target = self.max_bytes * 0.9
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if self._total <= target:
+                break
+            doomed.append((key,))
+            self._total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+class AsinCache:
+    """Persistent Amazon query → ASIN map; a stored empty ASIN records a miss."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS asins (
+                query TEXT PRIMARY KEY,
+                asin TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+
+    def get_many(self, queries: list, any_age: bool = False) -> dict:
+        """Return ``{query: asin_or_None}`` for the fresh entries among ``queries``.
+
+        ``any_age`` also returns expired entries: an unchanged title needs no new lookup.
+        """
+        if _force_refresh.get() or not queries:
+            return {}
+        now = time.time()
+        found = {}
+        with self._lock:
+            for i in range(0, len(queries), 500):
+                chunk = queries[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self._db.execute(f"SELECT query, asin, fetched_at FROM asins WHERE query IN ({marks})", chunk)
+                for query, asin, fetched_at in rows:
+                    ttl = ASIN_TTL if asin else ASIN_MISS_TTL
+                    if any_age or now - fetched_at <= ttl:
+                        found[query] = asin or None
+        return found
+
+    def put(self, query: str, asin: Optional[str]):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO asins VALUES (?, ?, ?)", (query, asin or "", time.time()))
+
+class ShopIndex:
+    """Persistent shop name → shopid map, filled from every search page we fetch.
+
+    Names are per market (one seller often uses the same name in several), so they
+    are stored ``scoped`` by market.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS shops (
+                shop_name TEXT PRIMARY KEY,
+                shopid INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def get(self, shop_name: str, market: str = DEFAULT_MARKET) -> Optional[int]:
+        with self._lock:
+            row = self._db.execute("SELECT shopid FROM shops WHERE shop_name = ?", (scoped(market, shop_name),)).fetchone()
+        return row[0] if row else None
+
+    def remember(self, pairs, market: str = DEFAULT_MARKET):
+        """Upsert ``(shop_name, shopid)`` pairs of ``market``, skipping blanks."""
+        now = time.time()
+        rows = {scoped(market, name): int(sid) for name, sid in pairs if name and sid}
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO shops VALUES (?, ?, ?)",
+                [(name, sid, now) for name, sid in rows.items()],
+            )
+
+    def remember_items(self, raw: list, market: str = DEFAULT_MARKET):
+        self.remember(
+            (((it.get("item_basic") or {}).get("shop_name"), (it.get("item_basic") or {}).get("shopid"))
+             for it in raw),
+            market,
+        )
+
+class ShopProfiles:
+    """Per-shop catalog profile: category histogram, Amazon-sourced item count and shop stats.
+
+    Profiles are what the specialist filters read, so vetting a known shop is a
+    lookup instead of a catalog fetch.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS shop_profiles (
+                shop_id INTEGER PRIMARY KEY,
+                shop_name TEXT,
+                item_count INTEGER NOT NULL,
+                scanned INTEGER NOT NULL,
+                amazon_items INTEGER NOT NULL,
+                categories TEXT NOT NULL,
+                follower_count INTEGER,
+                rating_count INTEGER,
+                rating_star REAL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def get(self, shop_id: int) -> Optional[dict]:
+        with self._lock:
+            cur = self._db.execute("SELECT * FROM shop_profiles WHERE shop_id = ?", (shop_id,))
+            row = cur.fetchone()
+        if not row:
+            return None
+        profile = dict(zip([c[0] for c in cur.description], row))
+        profile["categories"] = json.loads(profile["categories"])
+        return profile
+
+    def put(self, profile: dict):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO shop_profiles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (profile["shop_id"], profile["shop_name"], profile["item_count"], profile["scanned"],
+                 profile["amazon_items"], json.dumps(profile["categories"]), profile["follower_count"],
+                 profile["rating_count"], profile["rating_star"], profile["updated_at"]),
+            )
+
+class SnapshotStore:
+    """Local history of every freshly fetched item and shop, one snapshot per ID per day.
+
+    ``historical_sold`` is cumulative, so the difference between two snapshots of an
+    item is what it sold in between; the velocity queries read that off the time and
+    shop indexes instead of scanning the whole history.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS item_snapshots (
+                item_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                shop_id INTEGER NOT NULL,
+                taken_at REAL NOT NULL,
+                sold INTEGER NOT NULL,
+                price REAL,
+                title TEXT,
+                shop_name TEXT,
+                market TEXT NOT NULL DEFAULT 'jp',
+                PRIMARY KEY (item_id, day)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS item_snapshots_time ON item_snapshots(taken_at);
+            CREATE INDEX IF NOT EXISTS item_snapshots_shop ON item_snapshots(shop_id, taken_at);
+            CREATE TABLE IF NOT EXISTS shop_snapshots (
+                shop_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                taken_at REAL NOT NULL,
+                shop_name TEXT,
+                item_count INTEGER,
+                follower_count INTEGER,
+                rating_count INTEGER,
+                rating_star REAL,
+                market TEXT NOT NULL DEFAULT 'jp',
+                PRIMARY KEY (shop_id, day)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS shop_snapshots_time ON shop_snapshots(taken_at);
+            CREATE TABLE IF NOT EXISTS query_runs (
+                run_key TEXT PRIMARY KEY,
+                items BLOB NOT NULL,
+                fetched_at REAL NOT NULL,
+                pages INTEGER NOT NULL DEFAULT 0,
+                oldest_at REAL NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS query_runs_time ON query_runs(fetched_at);
+            CREATE TABLE IF NOT EXISTS shop_vets (
+                shop_id INTEGER NOT NULL,
+                criteria TEXT NOT NULL,
+                row TEXT,
+                vetted_at REAL NOT NULL,
+                PRIMARY KEY (shop_id, criteria)
+            );
+        """)
+        # Histories from before markets existed are all default-market
+        for table in ("item_snapshots", "shop_snapshots"):
+            columns = {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}
+            if "market" not in columns:
+                self._db.execute(f"ALTER TABLE {table} ADD COLUMN market TEXT NOT NULL DEFAULT '{DEFAULT_MARKET}'")
+        # Runs stored before coverage and age were tracked get neither, so they are dropped below
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(query_runs)")}
+        for column in ("pages INTEGER", "oldest_at REAL"):
+            if column.split()[0] not in columns:
+                self._db.execute(f"ALTER TABLE query_runs ADD COLUMN {column} NOT NULL DEFAULT 0")
+        self._db.execute("DELETE FROM query_runs WHERE oldest_at < ?", (time.time() - RUN_MAX_AGE,))
+        self._runs_total = self._db.execute("SELECT COALESCE(SUM(length(items)), 0) FROM query_runs").fetchone()[0]
+
+    def record(self, path: str, data: dict, market: str = DEFAULT_MARKET):
+        """Snapshot the items or shop in a fresh API response for ``path`` from ``market``."""
+        with stage("history"):
+            if path == "/search/search_items/":
+                self.record_items([it.get("item_basic") or {} for it in data.get("items") or []], market)
+            elif path == "/recommend/recommend_items/":
+                self.record_items(data.get("items") or [], market)
+            elif path == "/shop/get_shop_detail/":
+                self.record_shop(data.get("data") or {}, market)
+
+    def record_items(self, items: list, market: str = DEFAULT_MARKET):
+        """Upsert today's snapshot of each item (``item_basic``-shaped dicts)."""
+        now = time.time()
+        day = int(now // 86400)
+        rows = [
+            (it["itemid"], day, it["shopid"], now, it.get("historical_sold") or 0,
+             (it.get("price") or 0) / 100000, it.get("name"), it.get("shop_name"), market)
+            for it in items if it.get("itemid") and it.get("shopid")
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO item_snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def record_shop(self, info: dict, market: str = DEFAULT_MARKET):
+        if not info.get("shopid") or "item_count" not in info:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO shop_snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (info["shopid"], int(now // 86400), now, info.get("username"), info.get("item_count"),
+                 info.get("follower_count"), info.get("rating_count"), info.get("rating_star"), market),
+            )
+
+    def shop_velocity(self, since: float, limit: int = 500) -> list:
+        """Per-shop sold-per-day over items seen at least twice since ``since``, fastest first.
+
+        Rows are ``(shop_id, shop_name, items, sold, sold_per_day, first_seen, last_seen, market)``.
+        """
+        with self._lock:
+            return self._db.execute("""
+                WITH deltas AS (
+                    SELECT shop_id, MAX(shop_name) AS shop_name, MIN(taken_at) AS t0, MAX(taken_at) AS t1,
+                           MAX(sold) - MIN(sold) AS sold, MAX(market) AS market
+                    FROM item_snapshots INDEXED BY item_snapshots_time WHERE taken_at >= ?
+                    GROUP BY item_id HAVING t1 > t0
+                )
+                SELECT shop_id, MAX(shop_name), COUNT(*), SUM(sold), SUM(sold * 86400.0 / (t1 - t0)), MIN(t0), MAX(t1), MAX(market)
+                FROM deltas GROUP BY shop_id ORDER BY 5 DESC LIMIT ?
+            """, (since, limit)).fetchall()
+
+    def item_velocity(self, shop_id: int, since: float) -> list:
+        """Per-item sold-per-day for one shop since ``since``, fastest first.
+
+        Rows are ``(item_id, title, sold, sold_per_day, price, first_seen, last_seen)``.
+        """
+        with self._lock:
+            return self._db.execute("""
+                SELECT item_id, MAX(title), MAX(sold) - MIN(sold), (MAX(sold) - MIN(sold)) * 86400.0 / (MAX(taken_at) - MIN(taken_at)),
+                       MAX(price), MIN(taken_at), MAX(taken_at)
+                FROM item_snapshots WHERE shop_id = ? AND taken_at >= ?
+                GROUP BY item_id HAVING MAX(taken_at) > MIN(taken_at)
+                ORDER BY 4 DESC
+            """, (shop_id, since)).fetchall()
+
+    def last_run(self, run_key: str) -> Optional[tuple[list, int, float]]:
+        """``(items, pages, oldest_at)`` of the last stored run of a repeatable query,
+        or ``None`` when there is none or its oldest data is older than ``RUN_MAX_AGE``.
+
+        ``items`` are raw items in result order, covering the query's first ``pages``
+        pages; ``oldest_at`` is when the oldest of them was fetched.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT items, pages, oldest_at FROM query_runs WHERE run_key = ? AND oldest_at >= ?",
+                (run_key, time.time() - RUN_MAX_AGE),
+            ).fetchone()
+        return (json.loads(zlib.decompress(row[0])), row[1], row[2]) if row else None
+
+    def save_run(self, run_key: str, items: list, pages: int, oldest_at: Optional[float] = None):
+        """Store ``items`` as the last run of ``run_key``, evicting the oldest runs past ``RUN_MAX_BYTES``.
+
+        ``items`` cover the query's first ``pages`` pages; ``oldest_at`` is when the
+        oldest of them was fetched, now unless some were carried over from an earlier run.
+        """
+        blob = zlib.compress(json.dumps(items, ensure_ascii=False).encode())
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT length(items) FROM query_runs WHERE run_key = ?", (run_key,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO query_runs VALUES (?, ?, ?, ?, ?)",
+                             (run_key, blob, now, pages, oldest_at or now))
+            self._runs_total += len(blob) - (old[0] if old else 0)
+            if self._runs_total > RUN_MAX_BYTES:
+                self._evict_runs()
+
+    def _evict_runs(self):
+        # Trim to 90%, as the response cache does, so a full store doesn't evict on every save
+        target = RUN_MAX_BYTES * 0.9
+        doomed = []
+        for run_key, size in self._db.execute("SELECT run_key, length(items) FROM query_runs ORDER BY fetched_at"):
+            if self._runs_total <= target:
+                break
+            doomed.append((run_key,))
+            self._runs_total -= size
+        self._db.executemany("DELETE FROM query_runs WHERE run_key = ?", doomed)
+
+    def vet_result(self, shop_id: int, criteria: str, max_age: float) -> tuple[bool, Optional[dict]]:
+        """``(found, row_or_None)`` for a vetting of ``shop_id`` under ``criteria`` younger than ``max_age``."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT row FROM shop_vets WHERE shop_id = ? AND criteria = ? AND vetted_at >= ?",
+                (shop_id, criteria, time.time() - max_age),
+            ).fetchone()
+        if not row:
+            return False, None
+        return True, json.loads(row[0]) if row[0] else None
+
+    def save_vet(self, shop_id: int, criteria: str, row: Optional[dict]):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO shop_vets VALUES (?, ?, ?, ?)",
+                (shop_id, criteria, json.dumps(row, ensure_ascii=False) if row else None, time.time()),
+            )
+
+class JobStore:
+    """Checkpoints for long batch jobs: parameters, finished units of work and output rows.
+
+    A unit is a string such as ``"page:golf:3"`` or ``"shop:golf:12345"``; marking a
+    unit and appending its rows happen in one transaction, so a resumed job neither
+    loses nor duplicates rows.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS job_units (
+                job_id TEXT NOT NULL,
+                unit TEXT NOT NULL,
+                payload TEXT,
+                PRIMARY KEY (job_id, unit)
+            );
+            CREATE TABLE IF NOT EXISTS job_rows (
+                job_id TEXT NOT NULL,
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                row TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS job_rows_job ON job_rows(job_id, seq);
+        """)
+
+    def create(self, kind: str, params: dict) -> str:
+        job_id = time.strftime("%Y%m%d-%H%M%S-") + os.urandom(3).hex()
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, 'pending', ?, ?)",
+                (job_id, kind, json.dumps(params, ensure_ascii=False), now, now),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT job_id, kind, params, status, created_at, updated_at FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._job(row) if row else None
+
+    def list(self, limit: int = 50) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT j.job_id, j.kind, j.params, j.status, j.created_at, j.updated_at, "
+                "(SELECT COUNT(*) FROM job_rows r WHERE r.job_id = j.job_id) "
+                "FROM jobs j ORDER BY j.created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [{**self._job(row[:6]), "rows": row[6]} for row in rows]
+
+    def set_status(self, job_id: str, status: str):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", (status, time.time(), job_id))
+
+    def units(self, job_id: str, prefix: str) -> dict:
+        """``{unit: payload}`` for finished units starting with ``prefix``."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT unit, payload FROM job_units WHERE job_id = ? AND unit >= ? AND unit < ?",
+                (job_id, prefix, prefix + "\uffff"),
+            ).fetchall()
+        return {unit: json.loads(payload) if payload else None for unit, payload in rows}
+
+    def has(self, job_id: str, unit: str) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM job_units WHERE job_id = ? AND unit = ?", (job_id, unit)).fetchone()
+        return row is not None
+
+    def mark(self, job_id: str, unit: str, payload=None, rows=()):
+        with stage("checkpoint"), self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO job_units VALUES (?, ?, ?)",
+                    (job_id, unit, json.dumps(payload, ensure_ascii=False) if payload is not None else None),
+                )
+                self._db.executemany(
+                    "INSERT INTO job_rows (job_id, row) VALUES (?, ?)",
+                    [(job_id, json.dumps(row, ensure_ascii=False)) for row in rows],
+                )
+                self._db.execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def iter_rows(self, job_id: str, chunk_size: int = 5000):
+        """Yield the job's rows in order, as lists of at most ``chunk_size`` dicts.
+
+        Reads through its own connection, so a long read neither holds the store's
+        lock nor sees rows that a running job appends midway.
+        """
+        db = sqlite3.connect(self._path)
+        try:
+            cursor = db.execute("SELECT row FROM job_rows WHERE job_id = ? ORDER BY seq", (job_id,))
+            while chunk := cursor.fetchmany(chunk_size):
+                yield [json.loads(r[0]) for r in chunk]
+        finally:
+            db.close()
+
+    @staticmethod
+    def _job(row) -> dict:
+        job_id, kind, params, status, created_at, updated_at = row
+        return {
+            "job_id": job_id, "kind": kind, "params": json.loads(params), "status": status,
+            "created_at": created_at, "updated_at": updated_at,
+        }
+
+class AsyncRuntime:
+    """Background event loop that owns the shared, connection-pooled HTTP clients.
+
+    Callers may be Streamlit script threads, job threads or the CLI, so the async
+    clients live on a dedicated loop thread and sync callers hand coroutines over
+    with ``run`` / ``iterate``. Every Shopee market has its own client and limiter
+    (``shopee``); ``client`` and ``limiter`` are the default market's.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="shopee-http", daemon=True).start()
+        self.client = self.run(self._make_client(DEFAULT_MARKET))
+        self.amazon_client = self.run(self._make_amazon_client())
+        self.limiter = RateLimiter(rate=2.0, max_in_flight=4)
+        self.amazon_limiter = RateLimiter(rate=1.0, max_in_flight=2)
+        self.clients = {DEFAULT_MARKET: self.client}
+        self.limiters = {DEFAULT_MARKET: self.limiter}
+        self.cache = ResponseCache(DATA_DIR / "http_cache.sqlite")
+        self.asin_cache = AsinCache(DATA_DIR / "asin_cache.sqlite")
+        self.shop_index = ShopIndex(DATA_DIR / "shop_index.sqlite")
+        self.history = SnapshotStore(DATA_DIR / "history.sqlite")
+        self.category_trees = {}
+        self.profiles = ShopProfiles(DATA_DIR / "shop_profiles.sqlite")
+        self.jobs = JobStore(DATA_DIR / "jobs.sqlite")
+        self.runner = JobRunner(self.jobs)
+
+    def shopee(self, market: str) -> tuple[httpx.AsyncClient, RateLimiter]:
+        """``market``'s client and limiter, created on first use at the current Shopee settings.
+
+        Only called on the loop thread, so creation needs no lock.
+        """
+        if market not in MARKETS:
+            raise ValueError(f"unknown market: {market}")
+        if market not in self.clients:
+            self.clients[market] = self._client(market)
+            self.limiters[market] = RateLimiter(self.limiter.rate, self.limiter.max_in_flight)
+        return self.clients[market], self.limiters[market]
+
+    def configure_shopee(self, rate: float, max_in_flight: int):
+        """Give every market, present and future, its own budget of ``rate`` / ``max_in_flight``."""
+        for limiter in list(self.limiters.values()):
+            limiter.configure(rate, max_in_flight)
+
+    async def _make_client(self, market: str) -> httpx.AsyncClient:
+        return self._client(market)
+
+    def _client(self, market: str) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            headers={**HEADERS, "Referer": f"{MARKETS[market]['base']}/"},
+            timeout=20,
+            http2=True,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20, keepalive_expiry=120),
+        )
+
+    async def _make_amazon_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            headers=AMAZON_HEADERS,
+            timeout=15,
+            follow_redirects=True,
+            http2=True,
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=8, keepalive_expiry=120),
+        )
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def iterate(self, agen):
+        """Drive an async generator on the loop thread and yield its items to the caller."""
+        q = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    q.put((True, item))
+            except Exception as e:
+                q.put((False, e))
+            else:
+                q.put((False, None))
+            finally:
+                await agen.aclose()
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        try:
+            while True:
+                ok, value = q.get()
+                if not ok:
+                    if value is not None:
+                        raise value
+                    return
+                yield value
+        finally:
+            future.cancel()
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+def get_runtime() -> AsyncRuntime:
+    """Process-wide runtime, created on first use and shared by every caller."""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = AsyncRuntime()
+        return _runtime
+
+# ─────────────────────────────────────────────
+# API Functions
+# ─────────────────────────────────────────────
+
+async def shopee_get(path: str, params: dict, market: str = DEFAULT_MARKET) -> dict:
+    """GET a Shopee API path of ``market``, served from the response cache when fresh.
+
+    Raises ``FetchError`` when the request fails for good, so callers can tell an
+    error from an empty result. Requests go through the market's own client and
+    limiter and are reported under a ``scoped`` endpoint name.
+    """
+    rt = get_runtime()
+    client, limiter = rt.shopee(market)
+    endpoint = scoped(market, path)
+    started = time.perf_counter()
+    cached = await asyncio.to_thread(rt.cache.get, path, params, market)
+    if cached is not None:
+        stats = _current_run.get()
+        if stats:
+            stats.request(endpoint, status=200, latency=time.perf_counter() - started, cache="hit")
+        return cached
+    cache = "miss" if path in CACHE_TTL and not _force_refresh.get() else "bypass"
+    r = await http_get(client, limiter, f"{MARKETS[market]['api']}{path}", params, endpoint=endpoint, cache=cache)
+    if r.status_code != 200:
+        raise FetchError(f"{endpoint}: HTTP {r.status_code}")
+    try:
+        data = r.json()
+    except ValueError:
+        data = None
+    # A bot check or maintenance page can come back as a 200 that isn't API JSON
+    if not isinstance(data, dict):
+        raise FetchError(f"{endpoint}: unexpected response body ({r.headers.get('content-type', 'unknown type')})")
+    if data.get("error"):
+        raise FetchError(f"{endpoint}: API error {data['error']}")
+    await asyncio.to_thread(_store_response, path, params, r.content, data, market)
+    return data
+
+def _store_response(path: str, params: dict, body: bytes, data: dict, market: str):
+    """Cache a fresh response and snapshot its items; SQLite work, run off the event loop."""
+    rt = get_runtime()
+    rt.cache.put(path, params, body, market)
+    rt.history.record(path, data, market)
+
+async def shopee_search_async(keyword: str, page: int = 0, market: str = DEFAULT_MARKET) -> dict:
+    params = {
+        "by": "sales",
+        "keyword": keyword,
+        "limit": 60,
+        "newest": page * 60,
+        "order": "desc",
+        "page_type": "search",
+        "scenario": "PAGE_GLOBAL_SEARCH",
+        "version": 2,
+    }
+    return await shopee_get("/search/search_items/", params, market)
+
+async def shopee_category_search_async(category_id: int, page: int = 0, market: str = DEFAULT_MARKET) -> dict:
+    params = {
+        "by": "sales",
+        "limit": 60,
+        "newest": page * 60,
+        "order": "desc",
+        "catid": category_id,
+        "version": 2,
+    }
+    return await shopee_get("/search/search_items/", params, market)
+
+async def get_shop_info_async(shop_id: int, market: str = DEFAULT_MARKET) -> dict:
+    data = await shopee_get("/shop/get_shop_detail/", {"shopid": shop_id}, market)
+    return data.get("data") or {}
+
+async def get_shop_items_async(shop_id: int, page: int = 0, limit: int = 100, market: str = DEFAULT_MARKET) -> list:
+    params = {
+        "shopid": shop_id,
+        "sort_by": "sales",
+        "order": "desc",
+        "limit": limit,
+        "offset": page * limit,
+        "filter_sold_out": 0,
+    }
+    data = await shopee_get("/recommend/recommend_items/", params, market)
+    return data.get("items") or []
+
+async def get_category_tree_async(market: str = DEFAULT_MARKET) -> list:
+    data = await shopee_get("/pages/get_category_tree", {}, market)
+    return (data.get("data") or {}).get("category_list") or []
+
+async def iter_pages_async(fetch, pages: int, market: str = DEFAULT_MARKET, first: int = 0):
+    """Request pages ``first`` to ``pages - 1`` at once and yield their raw items in page order.
+
+    ``fetch(page)`` is an async search function of ``market``; that market's limiter
+    paces the burst. Stops at the first empty page, like the sequential loops did.
+    """
+    tasks = [asyncio.ensure_future(fetch(page)) for page in range(first, pages)]
+    try:
+        for task in tasks:
+            raw = (await task).get("items") or []
+            if not raw:
+                break
+            await asyncio.to_thread(get_runtime().shop_index.remember_items, raw, market)
+            yield raw
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def raw_item_id(item: dict):
+    return (item.get("item_basic") or item).get("itemid")
+
+async def iter_run_pages_async(run_key: str, fetch, pages: int, incremental: bool = False,
+                               market: str = DEFAULT_MARKET):
+    """``iter_pages_async`` for a repeatable query that can be refreshed incrementally.
+
+    With ``incremental`` and a stored run, pages are fetched one at a time until
+    one within the stored run's pages mostly (``OVERLAP_STOP``) repeats it; the
+    rest of the stored run is then yielded as one batch instead of being
+    refetched. Results are ranked by sales, so below that point little moves.
+    Pages past the stored run's are fetched as usual. Only incremental runs are
+    stored under ``run_key``, as the next one's baseline; a baseline whose
+    reused data has grown older than ``RUN_MAX_AGE`` is refetched in full.
+    """
+    history = get_runtime().history
+    baseline = await asyncio.to_thread(history.last_run, run_key) if incremental else None
+    fetched = []
+    if baseline is None:
+        async for raw in iter_pages_async(fetch, pages, market):
+            if incremental:
+                fetched.extend(raw)
+            yield raw
+        if incremental:
+            await asyncio.to_thread(history.save_run, run_key, fetched, pages)
+        return
+
+    previous, covered, oldest_at = baseline
+    known = {raw_item_id(it) for it in previous}
+    reused = False
+    page = 0
+    while page < pages:
+        raw = (await fetch(page)).get("items") or []
+        if not raw:
+            await asyncio.to_thread(history.save_run, run_key, fetched, pages)
+            return
+        await asyncio.to_thread(get_runtime().shop_index.remember_items, raw, market)
+        fetched.extend(raw)
+        yield raw
+        page += 1
+        if page <= covered and sum(raw_item_id(it) in known for it in raw) >= OVERLAP_STOP * len(raw):
+            seen = {raw_item_id(it) for it in fetched}
+            tail = [it for it in previous if raw_item_id(it) not in seen][:min(covered, pages) * len(raw) - len(fetched)]
+            if tail:
+                fetched.extend(tail)
+                reused = True
+                yield tail
+            page = covered
+            break
+
+    seen = {raw_item_id(it) for it in fetched}
+    async for raw in iter_pages_async(fetch, pages, market, first=page):
+        # Ranks shift between runs, so an item carried over may turn up again further down
+        batch = [it for it in raw if raw_item_id(it) not in seen]
+        seen.update(raw_item_id(it) for it in batch)
+        if batch:
+            fetched.extend(batch)
+            yield batch
+    await asyncio.to_thread(history.save_run, run_key, fetched, pages, oldest_at if reused else None)
+
+async def merge_async(streams: dict):
+    """Drive every async generator in ``streams`` at once, yielding ``(key, item)`` as items land.
+
+    An exception in one stream cancels the others and propagates.
+    """
+    merged = asyncio.Queue()
+    done = object()
+
+    async def pump(key, agen):
+        try:
+            async for item in agen:
+                await merged.put((key, item, None))
+        except Exception as e:
+            await merged.put((key, done, e))
+        else:
+            await merged.put((key, done, None))
+        finally:
+            await agen.aclose()
+
+    tasks = [asyncio.ensure_future(pump(key, agen)) for key, agen in streams.items()]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            key, item, error = await merged.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                remaining -= 1
+                continue
+            yield key, item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def fan_out_pages(runs: dict, pages: int, incremental: bool = False):
+    """``iter_run_pages_async`` for several queries at once: yields ``(key, raw)`` as pages land.
+
+    ``runs`` maps a key to ``(fetch, run_key, market, label)``, with ``fetch(page)``
+    an async search function of ``market``. Each query stores its run under its
+    ``run_key``. An API error ends only that query's pages; once the others are
+    done, a ``FetchError`` naming the failed queries' ``label`` is raised.
+    """
+    async def pages_of(fetch, run_key, market):
+        try:
+            async for raw in iter_run_pages_async(run_key, fetch, pages, incremental, market):
+                yield raw
+        except Exception as e:
+            yield e
+
+    streams = {key: pages_of(fetch, run_key, market) for key, (fetch, run_key, market, _) in runs.items()}
+    failed = []
+    for key, raw in get_runtime().iterate(merge_async(streams)):
+        if isinstance(raw, Exception):
+            failed.append(f"{runs[key][3]}: {raw}")
+        else:
+            yield key, raw
+    if failed:
+        raise FetchError(f"{len(failed)}/{len(runs)} 件の検索に失敗しました — " + " / ".join(failed))
+
+def market_pages(fetch, pages: int, run_key: str, markets: list, incremental: bool = False):
+    """``fan_out_pages`` over ``markets``: yields ``(market, raw)`` as pages land.
+
+    ``fetch(page, market)`` is an async search function. Each market pages through
+    its own limiter and stores its run under ``scoped(market, run_key)``.
+    """
+    runs = {
+        market: (lambda p, m=market: fetch(p, m), scoped(market, run_key), market, MARKETS[market]["label"])
+        for market in markets
+    }
+    yield from fan_out_pages(runs, pages, incremental)
+
+async def crawl_shop_async(shop_id: int, item_count: Optional[int] = None, max_pages: Optional[int] = None,
+                           incremental: bool = False, market: str = DEFAULT_MARKET, remember: bool = False):
+    """Stream a shop's whole catalog as batches of raw items, each ``itemid`` once.
+
+    Pages are planned from ``item_count`` (looked up when not given) and all
+    requested at once, with the shared limiter pacing them; batches are yielded in
+    arrival order. A full last page means the count was stale, so paging then
+    continues one page at a time. ``incremental`` reuses the shop's last stored
+    run as in ``iter_run_pages_async``; the catalog is stored for that when
+    crawling incrementally or with ``remember``. The shop is fetched from ``market``.
+    """
+    if item_count is None:
+        item_count = (await get_shop_info_async(shop_id, market)).get("item_count") or 0
+    planned = max(1, -(-item_count // CATALOG_PAGE_SIZE))
+    if max_pages:
+        planned = min(planned, max_pages)
+
+    async def fetch(page):
+        return {"items": await get_shop_items_async(shop_id, page=page, limit=CATALOG_PAGE_SIZE, market=market)}
+
+    seen = set()
+
+    def fresh(raw):
+        batch = [it for it in raw if raw_item_id(it) not in seen]
+        seen.update(raw_item_id(it) for it in batch)
+        return batch
+
+    history = get_runtime().history
+    run_key = scoped(market, f"shop:{shop_id}")
+    baseline = await asyncio.to_thread(history.last_run, run_key) if incremental else None
+    if baseline is not None:
+        # The stored run may be longer than a stale item_count suggests
+        window = max(planned, baseline[1])
+        async for raw in iter_run_pages_async(run_key, fetch, min(window, max_pages or window), incremental=True,
+                                              market=market):
+            if batch := fresh(raw):
+                yield batch
+        return
+
+    async def numbered(page):
+        return page, (await fetch(page)).get("items") or []
+
+    pages = {}
+    tasks = [asyncio.ensure_future(numbered(page)) for page in range(planned)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            page, raw = await next_done
+            pages[page] = raw
+            if batch := fresh(raw):
+                yield batch
+        page = planned
+        while len(pages[page - 1]) == CATALOG_PAGE_SIZE and not (max_pages and page >= max_pages):
+            page, raw = await numbered(page)
+            pages[page] = raw
+            if batch := fresh(raw):
+                yield batch
+            page += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if not (incremental or remember):
+        return
+    catalog = {}
+    for page in sorted(pages):
+        for it in pages[page]:
+            catalog.setdefault(raw_item_id(it), it)
+    await asyncio.to_thread(history.save_run, run_key, list(catalog.values()), len(pages))
+
+async def resolve_shop_id_async(shop_name: str, market: str = DEFAULT_MARKET) -> Optional[int]:
+    """Look ``shop_name`` up in the shop index before asking the API, and remember the answer."""
+    index = get_runtime().shop_index
+    sid = await asyncio.to_thread(index.get, shop_name, market)
+    if sid:
+        return sid
+    try:
+        detail = await shopee_get("/shop/get_shop_detail/", {"username": shop_name}, market)
+        sid = (detail.get("data") or {}).get("shopid")
+        if sid:
+            await asyncio.to_thread(index.remember, [(shop_name, sid)], market)
+            return sid
+    except FetchError as e:
+        log.info(f"{shop_name}: {e}")
+    data = await shopee_search_async(shop_name, 0, market)
+    await asyncio.to_thread(index.remember_items, data.get("items") or [], market)
+    return await asyncio.to_thread(index.get, shop_name, market)
+
+def resolve_shop_id(shop_name: str, market: str = DEFAULT_MARKET) -> Optional[int]:
+    return get_runtime().run(resolve_shop_id_async(shop_name, market))
+
+def get_shop_info(shop_id: int, market: str = DEFAULT_MARKET) -> dict:
+    return get_runtime().run(get_shop_info_async(shop_id, market))
+
+# ─────────────────────────────────────────────
+# Categories
+# ─────────────────────────────────────────────
+
+class CategoryTree:
+    """One market's category tree, indexed by ID and searchable by name or ID.
+
+    ``nodes`` maps a category ID to ``{"name", "parent", "children", "path"}``,
+    where ``path`` is the names from the top level down, joined by " > ".
+    """
+
+    def __init__(self, category_list: list):
+        self.nodes = {}
+        self.roots = []
+        stack = [(raw, None) for raw in reversed(category_list)]
+        while stack:
+            raw, parent = stack.pop()
+            cat_id = raw.get("catid")
+            if not cat_id or cat_id in self.nodes:
+                continue
+            name = raw.get("display_name") or raw.get("name") or str(cat_id)
+            path = f"{self.nodes[parent]['path']} > {name}" if parent else name
+            self.nodes[cat_id] = {"name": name, "parent": parent, "children": [], "path": path}
+            if parent:
+                self.nodes[parent]["children"].append(cat_id)
+            else:
+                self.roots.append(cat_id)
+            stack.extend((child, cat_id) for child in reversed(raw.get("children") or []))
+        self._index = [(node["path"].lower(), cat_id) for cat_id, node in self.nodes.items()]
+
+    def label(self, cat_id: int) -> str:
+        node = self.nodes.get(cat_id)
+        return f"{node['path']} ({cat_id})" if node else str(cat_id)
+
+    def search(self, query: str, limit: int = 100) -> list:
+        """IDs of the categories whose path contains every word of ``query``, shallowest first;
+        a numeric ``query`` also matches that ID exactly."""
+        query = query.strip().lower()
+        exact = [int(query)] if query.isdigit() and int(query) in self.nodes else []
+        words = query.split()
+        hits = [cat_id for path, cat_id in self._index if all(w in path for w in words) and cat_id not in exact]
+        hits.sort(key=lambda cat_id: self.nodes[cat_id]["path"].count(" > "))
+        return (exact + hits)[:limit]
+
+    def leaves(self, cat_id: int) -> list:
+        """Leaf categories under ``cat_id`` (itself when it has no children or isn't in the tree)."""
+        leaves = []
+        stack = [cat_id]
+        while stack:
+            current = stack.pop()
+            children = self.nodes.get(current, {}).get("children")
+            if children:
+                stack.extend(reversed(children))
+            else:
+                leaves.append(current)
+        return leaves
+
+def category_tree(market: str = DEFAULT_MARKET) -> CategoryTree:
+    """``market``'s category tree, built once per process and refreshed with its response.
+
+    The response cache keeps the tree on disk for its ``CACHE_TTL``. When it can't
+    be loaded the default market falls back to the top-level ``SHOPEE_CATEGORIES``
+    (other markets get an empty tree) until ``CATEGORY_TREE_RETRY`` has passed.
+    """
+    rt = get_runtime()
+    now = time.time()
+    expires, tree = rt.category_trees.get(market, (0, None))
+    if tree is not None and now < expires:
+        return tree
+    try:
+        tree = CategoryTree(rt.run(get_category_tree_async(market)))
+        expires = now + CACHE_TTL["/pages/get_category_tree"]
+    except Exception as e:
+        log.warning(f"カテゴリツリーを取得できません ({MARKETS[market]['label']}): {e}")
+        tree = None
+    if not tree or not tree.nodes:
+        fallback = SHOPEE_CATEGORIES if market == DEFAULT_MARKET else {}
+        tree = CategoryTree([{"catid": cat_id, "name": label} for label, cat_id in fallback.items()])
+        expires = now + CATEGORY_TREE_RETRY
+    rt.category_trees[market] = (expires, tree)
+    return tree
+
+# ─────────────────────────────────────────────
+# ASIN Lookup
+# ─────────────────────────────────────────────
+
+# An ASIN written into a listing title, not glued to other letters or digits
+ASIN_PATTERN = re.compile(r'(?<![A-Z0-9])B0[A-Z0-9]{8}(?![A-Z0-9])')
+
+def embedded_asin(title: str) -> Optional[str]:
+    match = ASIN_PATTERN.search(title or "")
+    return match.group(0) if match else None
+
+def asin_query(title: str) -> str:
+    clean = re.sub(r'[【】「」\[\]（）()]', ' ', title)
+    return ' '.join(clean.split()[:8])
+
+async def fetch_asin_async(query: str) -> tuple[Optional[str], bool]:
+    """Scrape Amazon search for ``query``; the flag is False when the lookup itself failed."""
+    rt = get_runtime()
+    try:
+        r = await http_get(rt.amazon_client, rt.amazon_limiter, f"{AMAZON_BASE}/s", {"k": query},
+                           endpoint="amazon:/s")
+    except FetchError as e:
+        log.info(str(e))
+        return None, False
+    if r.status_code != 200:
+        return None, False
+    asins = re.findall(r'/dp/([A-Z0-9]{10})', r.text)
+    return (asins[0] if asins else None), True
+
+async def iter_asins_async(queries: list):
+    """Look up all ``queries`` concurrently and yield ``(query, asin, ok)`` as each finishes."""
+    async def lookup(query):
+        asin, ok = await fetch_asin_async(query)
+        if ok:
+            await asyncio.to_thread(get_runtime().asin_cache.put, query, asin)
+        return query, asin, ok
+
+    tasks = [asyncio.ensure_future(lookup(q)) for q in queries]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def resolve_asins(titles: list, on_progress=None, incremental: bool = False) -> dict:
+    """Resolve ``titles`` to ``{title: (asin_or_None, tier)}``, cheapest tier first.
+
+    The tier is ``"title"`` for an ASIN embedded in the title, ``"cache"`` for the
+    ASIN cache and ``"amazon"`` for a remote search; unresolved titles get ``""``.
+    Only titles that neither of the first two tiers answers reach Amazon, once per
+    distinct query, with ``on_progress(done, total)`` called as each completes.
+    With ``incremental`` every title looked up before is reused however old the entry.
+    """
+    with stage("asin"):
+        resolved = _resolve_asins(titles, on_progress, incremental)
+    stats = _current_run.get()
+    if stats:
+        for tier, name in (("title", "asin_title"), ("cache", "asin_cache"), ("amazon", "asin_remote"), ("", "asin_unresolved")):
+            stats.count(name, sum(1 for _, t in resolved.values() if t == tier))
+    return resolved
+
+def _resolve_asins(titles: list, on_progress, incremental: bool) -> dict:
+    resolved = {}
+    queries = {}
+    for title in dict.fromkeys(titles):
+        asin = embedded_asin(title)
+        if asin:
+            resolved[title] = (asin, "title")
+        else:
+            queries[title] = asin_query(title)
+
+    distinct = list(dict.fromkeys(q for q in queries.values() if q))
+    rt = get_runtime()
+    cached = rt.asin_cache.get_many(distinct, any_age=incremental)
+    misses = [q for q in distinct if q not in cached]
+
+    remote = {}
+    failed = 0
+    for done, (query, asin, ok) in enumerate(rt.iterate(iter_asins_async(misses)), start=1):
+        remote[query] = asin
+        failed += not ok
+        if on_progress:
+            on_progress(done, len(misses))
+    if failed:
+        log.warning(f"Amazon 検索に失敗した商品が {failed} 件あります（次回の実行で再取得します）")
+
+    for title, query in queries.items():
+        if cached.get(query):
+            resolved[title] = (cached[query], "cache")
+        elif remote.get(query):
+            resolved[title] = (remote[query], "amazon")
+        else:
+            resolved[title] = (None, "")
+    return resolved
+
+# ─────────────────────────────────────────────
+# Parsing & Filtering
+# ─────────────────────────────────────────────
+
+# Output column -> (item_basic key, default) for the batch parser
+ITEM_FIELDS = {
+    "shop_name": ("shop_name", ""),
+    "shop_id": ("shopid", 0),
+    "item_id": ("itemid", 0),
+    "title": ("name", ""),
+    "sold": ("historical_sold", 0),
+    "price": ("price", 0),
+    "is_preferred": ("is_preferred_plus_seller", False),
+    "location": ("shop_location", ""),
+}
+
+def items_frame(raw: list, market: str = DEFAULT_MARKET) -> pd.DataFrame:
+    """Parse raw search ``items`` (one page or many concatenated) of ``market`` into an item frame in one pass.
+
+    Columns follow the ``item`` schema; the location filter is left to ``filter_items``.
+    """
+    basics = [item.get("item_basic") or {} for item in raw]
+    df = pd.DataFrame({col: [b.get(key, default) for b in basics] for col, (key, default) in ITEM_FIELDS.items()})
+    for col in ("shop_id", "item_id", "sold", "price"):
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+    df["price"] = df["price"] / 100000
+    df["is_preferred"] = df["is_preferred"].fillna(False).astype(bool)
+    df["market"] = market
+    df["currency"] = MARKETS[market]["currency"]
+    df = conform(df, "item")
+    df["shop_name"] = df["shop_name"].fillna("")
+    df["location"] = df["location"].fillna("")
+    df["shop_url"] = MARKETS[market]["base"] + "/" + df["shop_name"]
+    df["item_url"] = df["shop_url"] + "-i." + df["shop_id"].astype("string") + "." + df["item_id"].astype("string")
+    return df
+
+def filter_items(items: pd.DataFrame, *, japan_only: bool, preferred_only: bool = False, min_sold: int = 0) -> pd.DataFrame:
+    """Rows of an item frame that pass the search filters, as one vectorized mask."""
+    mask = items["sold"] >= min_sold
+    if japan_only:
+        mask &= items["location"] == "Japan"
+    if preferred_only:
+        mask &= items["is_preferred"]
+    return items[mask].reset_index(drop=True)
+
+# ─────────────────────────────────────────────
+# Specialist Shop Pipeline
+# ─────────────────────────────────────────────
+AMAZON_MARKERS = ["Amazon", "アマゾン"]
+
+# Item columns a candidate shop carries into vetting (and into job checkpoints)
+CANDIDATE_FIELDS = ["shop_name", "shop_id", "shop_url", "is_preferred", "location", "market"]
+
+def is_amazon_sourced(title: str) -> bool:
+    return bool(ASIN_PATTERN.search(title)) or any(m in title for m in AMAZON_MARKERS)
+
+def catalog_profile(shop_id: int, info: dict, items: list) -> dict:
+    """Profile of a shop from its detail response and (raw) catalog items."""
+    categories = {}
+    amazon_items = 0
+    for it in items:
+        cats = it.get("categories") or []
+        if cats:
+            catid = str(cats[0].get("catid", 0))
+            categories[catid] = categories.get(catid, 0) + 1
+        if is_amazon_sourced(it.get("name") or ""):
+            amazon_items += 1
+    return {
+        "shop_id": shop_id,
+        "shop_name": info.get("username"),
+        "item_count": info.get("item_count") or len(items),
+        "scanned": len(items),
+        "amazon_items": amazon_items,
+        "categories": categories,
+        "follower_count": info.get("follower_count", 0),
+        "rating_count": info.get("rating_count", 0),
+        "rating_star": info.get("rating_star", 0),
+        "updated_at": time.time(),
+    }
+
+def profile_category_count(profile: dict) -> int:
+    """Top-level categories holding at least ``CATEGORY_MIN_SHARE`` of the scanned catalog."""
+    floor = CATEGORY_MIN_SHARE * profile["scanned"]
+    return sum(1 for n in profile["categories"].values() if n >= floor)
+
+async def shop_profile_async(shop_id: int, market: str = DEFAULT_MARKET) -> Optional[dict]:
+    """The shop's profile from the index, (re)built from its catalog when missing or stale.
+
+    A stale profile is refreshed incrementally: catalog paging stops where the
+    shop's last stored run begins to repeat.
+    """
+    profiles = get_runtime().profiles
+    profile = await asyncio.to_thread(profiles.get, shop_id)
+    if profile and time.time() - profile["updated_at"] < PROFILE_REFRESH_AGE:
+        return profile
+
+    info = await get_shop_info_async(shop_id, market)
+    items = []
+    # The first crawl is kept as the baseline of the next (incremental) refresh
+    crawl = crawl_shop_async(shop_id, info.get("item_count") or 0, PROFILE_MAX_PAGES,
+                             incremental=profile is not None, market=market, remember=True)
+    async for batch in crawl:
+        items.extend(batch)
+    if not items:
+        return None
+    profile = catalog_profile(shop_id, info, items)
+    await asyncio.to_thread(profiles.put, profile)
+    return profile
+
+async def vet_shop_async(shop: dict, max_cats: int, amazon_only: bool, min_products: int) -> Optional[dict]:
+    """Check a candidate against its catalog profile; only a missing or stale profile costs API calls."""
+    sid = shop["shop_id"]
+    # Candidates checkpointed before markets existed carry none
+    market = shop.get("market") or DEFAULT_MARKET
+    profile = await shop_profile_async(sid, market)
+    if profile is None:
+        return None
+
+    cat_count = profile_category_count(profile)
+    if cat_count > max_cats:
+        return None
+    if amazon_only and profile["amazon_items"] < 1:
+        return None
+    if min_products > 0 and profile["item_count"] < min_products:
+        return None
+
+    return {
+        "マーケット": market,
+        "店舗名": shop["shop_name"],
+        "店舗ID": sid,
+        "店舗URL": shop["shop_url"],
+        "Preferred": "⭐ YES" if shop["is_preferred"] else "NO",
+        "カテゴリ数": cat_count,
+        "Amazon比率": round(profile["amazon_items"] / profile["scanned"], 2),
+        "商品数": profile["item_count"],
+        "フォロワー数": profile["follower_count"],
+        "レビュー数": profile["rating_count"],
+        "評価": round(profile["rating_star"] or 0, 1),
+    }
+
+async def specialist_shops_async(keyword: str, pages: int, *, japan_only: bool, preferred_only: bool,
+                                 min_sold: int, max_cats: int, amazon_only: bool, min_products: int,
+                                 workers: int = 4, skip=(), candidates: Optional[list] = None,
+                                 incremental: bool = False, market: str = DEFAULT_MARKET):
+    """Stream candidate shops from the search stage into ``workers`` parallel vetters.
+
+    Yields ``("candidate", shop)`` for each new shop, ``("page", n)`` as search pages
+    land, ``("searched", n)`` once the search stage completes, ``("shop", (shop,
+    row_or_None))`` as each shop finishes vetting, ``("failed", (shop, exc))`` when a
+    shop could not be fetched or vetted, and ``("error", exc)`` if the search stage fails.
+    Passing ``candidates`` replaces the search stage with a known shop list; shop
+    IDs in ``skip`` are never vetted. ``incremental`` stops paging where the last
+    run of the keyword begins to repeat and reuses vetting results younger than
+    ``VET_REFRESH_AGE``. Searches and shops are fetched from ``market``.
+    """
+    pending = asyncio.Queue()
+    events = asyncio.Queue()
+
+    async def search_stage():
+        seen = set(skip)
+        try:
+            if candidates is not None:
+                for shop in candidates:
+                    if shop["shop_id"] not in seen:
+                        seen.add(shop["shop_id"])
+                        await pending.put(shop)
+                await events.put(("searched", 0))
+                return
+            page = 0
+            fetch = lambda p: shopee_search_async(keyword, p, market)
+            run_key = scoped(market, f"keyword:{keyword}")
+            async for raw in iter_run_pages_async(run_key, fetch, pages, incremental, market):
+                with stage("parse"):
+                    batch = filter_items(items_frame(raw, market), japan_only=japan_only, preferred_only=preferred_only, min_sold=min_sold)
+                shops = batch[~batch["shop_id"].isin(seen)].drop_duplicates("shop_id")
+                for shop in shops[CANDIDATE_FIELDS].to_dict("records"):
+                    seen.add(shop["shop_id"])
+                    await events.put(("candidate", shop))
+                    await pending.put(shop)
+                page += 1
+                await events.put(("page", page))
+            await events.put(("searched", page))
+        except Exception as e:
+            await events.put(("error", e))
+        finally:
+            for _ in range(workers):
+                await pending.put(None)
+
+    history = get_runtime().history
+    criteria = json.dumps([max_cats, amazon_only, min_products])
+
+    async def vet_worker():
+        # Any failure is reported per shop; "done" must always arrive or the consumer waits forever
+        try:
+            while (shop := await pending.get()) is not None:
+                try:
+                    found, row = (await asyncio.to_thread(history.vet_result, shop["shop_id"], criteria, VET_REFRESH_AGE)
+                                  if incremental else (False, None))
+                    if not found:
+                        with stage("vet"):
+                            row = await vet_shop_async(shop, max_cats, amazon_only, min_products)
+                        await asyncio.to_thread(history.save_vet, shop["shop_id"], criteria, row)
+                except Exception as e:
+                    await events.put(("failed", (shop, e)))
+                    continue
+                await events.put(("shop", (shop, {"検索キーワード": keyword, **row} if row else None)))
+        finally:
+            events.put_nowait(("done", None))
+
+    tasks = [asyncio.ensure_future(search_stage())]
+    tasks += [asyncio.ensure_future(vet_worker()) for _ in range(workers)]
+    try:
+        finished = 0
+        while finished < workers:
+            kind, payload = await events.get()
+            if kind == "done":
+                finished += 1
+                continue
+            yield kind, payload
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# ─────────────────────────────────────────────
+# Workflows
+# ─────────────────────────────────────────────
+
+def keyword_search(keyword: str, pages: int, *, japan_only: bool = True, preferred_only: bool = False,
+                   min_sold: int = 1, on_page=None, on_batch=None, incremental: bool = False,
+                   markets: Optional[list] = None) -> pd.DataFrame:
+    """① Item frame of everything matching ``keyword`` (by sales) that passes the filters.
+
+    ``markets`` (default: the default market) are searched at once and their items
+    merged, tagged by ``market``. ``on_page(done, total)`` reports progress over all
+    markets' pages; ``on_batch(frame)`` gets each page's matches. ``incremental``
+    refetches only the pages that changed since the last run of the keyword.
+    A market whose pages fail doesn't stop the others; ``PartialResult`` is then
+    raised with their items.
+    """
+    markets = markets or [DEFAULT_MARKET]
+    table = ResultTable("item")
+    page_iter = market_pages(lambda p, m: shopee_search_async(keyword, p, m), pages, f"keyword:{keyword}", markets, incremental)
+    try:
+        for page, (market, raw) in enumerate(page_iter, start=1):
+            with stage("parse"):
+                batch = filter_items(items_frame(raw, market), japan_only=japan_only, preferred_only=preferred_only, min_sold=min_sold)
+                table.append(batch)
+            if on_batch:
+                on_batch(batch)
+            if on_page:
+                on_page(page, pages * len(markets))
+    except FetchError as e:
+        raise PartialResult(str(e), table.frame()) from e
+    return table.frame()
+
+def aggregate_shops(items: pd.DataFrame, min_products: int = 0) -> pd.DataFrame:
+    """Roll an item frame up into one row per shop, best sellers first."""
+    with stage("aggregate"):
+        return _aggregate_shops(items, min_products)
+
+def _aggregate_shops(items: pd.DataFrame, min_products: int) -> pd.DataFrame:
+    shops = items.groupby(["market", "shop_id"], sort=False, dropna=False).agg(
+        店舗名=("shop_name", "first"),
+        店舗URL=("shop_url", "first"),
+        Preferred=("is_preferred", "first"),
+        地域=("location", "first"),
+        総Sold数=("sold", "sum"),
+        商品数=("sold", "size"),
+    ).reset_index().rename(columns={"market": "マーケット", "shop_id": "店舗ID"})
+    shops["Preferred"] = shops["Preferred"].map({True: "⭐ YES", False: "NO"}).fillna("NO")
+    if min_products > 0:
+        shops = shops[shops["商品数"] >= min_products]
+    shops = shops.sort_values("総Sold数", ascending=False, kind="stable")
+    return conform(shops.reset_index(drop=True), "shop")
+
+def category_search(category_id: int, pages: int, *, japan_only: bool = True, min_sold: int = 1,
+                    on_page=None, on_batch=None, incremental: bool = False,
+                    market: str = DEFAULT_MARKET, subtree: bool = False) -> pd.DataFrame:
+    """② Item frame for ``category_id`` of ``market`` (by sales) after the filters.
+
+    Category IDs are per market, so this searches one. With ``subtree``, every leaf
+    category under ``category_id`` is searched at once for ``pages`` pages each,
+    reaching niches a top-level search never pages down to; an item listed under
+    several leaves is kept once. Other options, and ``PartialResult`` when some
+    leaves fail, as in ``keyword_search``.
+    """
+    leaves = category_tree(market).leaves(category_id) if subtree else [category_id]
+    runs = {
+        leaf: (lambda p, c=leaf: shopee_category_search_async(c, p, market), scoped(market, f"category:{leaf}"),
+               market, f"{MARKETS[market]['label']} {leaf}")
+        for leaf in leaves
+    }
+    table = ResultTable("item")
+    seen = set()
+    try:
+        for page, (_, raw) in enumerate(fan_out_pages(runs, pages, incremental), start=1):
+            fresh = []
+            for it in raw:
+                if raw_item_id(it) not in seen:
+                    seen.add(raw_item_id(it))
+                    fresh.append(it)
+            with stage("parse"):
+                batch = filter_items(items_frame(fresh, market), japan_only=japan_only, min_sold=min_sold)
+                table.append(batch)
+            if on_batch:
+                on_batch(batch)
+            if on_page:
+                on_page(page, pages * len(leaves))
+    except FetchError as e:
+        raise PartialResult(str(e), table.frame()) from e
+    return table.frame()
+
+def attach_asins(items: pd.DataFrame, on_progress=None, incremental: bool = False):
+    """Fill the ``asin``/``asin_source``/``amazon_url`` columns of an item frame in place."""
+    resolved = resolve_asins(items["title"].fillna("").tolist(), on_progress=on_progress, incremental=incremental)
+    titles = items["title"].fillna("")
+    asin = titles.map({t: a or "" for t, (a, _) in resolved.items()}).astype("string")
+    items["asin"] = asin
+    items["asin_source"] = titles.map({t: tier for t, (_, tier) in resolved.items()}).astype("string")
+    items["amazon_url"] = (f"{AMAZON_BASE}/dp/" + asin).where(asin != "", "")
+
+def category_frame(items, with_asin: bool) -> pd.DataFrame:
+    """② export view of an item frame (or a list of parsed items)."""
+    df = conform(pd.DataFrame(items), "item")
+    cols = ["market", "title", "item_url", "sold", "price", "currency", "is_preferred", "shop_name", "shop_id"]
+    if with_asin:
+        cols += ["asin", "amazon_url", "asin_source"]
+    df = df[[c for c in cols if c in df.columns]]
+    df.columns = ["マーケット", "タイトル", "商品URL", "Sold", "価格(¥)", "通貨", "Preferred", "店舗名", "店舗ID"] + (["ASIN", "AmazonURL", "ASIN取得元"] if with_asin else [])
+    return df
+
+def parse_keywords(text: str) -> list:
+    return [row.strip() for row in text.split("\n") if row.strip()]
+
+def shop_name_from_url(shop_url: str) -> str:
+    return shop_url.rstrip("/").split("/")[-1]
+
+def load_shop_list(df: pd.DataFrame) -> list:
+    """Shop URLs from an exported CSV; a 店舗ID column is fed into the shop index
+    under each URL's market.
+
+    Raises ``ValueError`` when no column name contains "URL".
+    """
+    url_col = None
+    for col in df.columns:
+        if "URL" in col or "url" in col:
+            url_col = col
+            break
+    if not url_col:
+        raise ValueError("「URL」を含む列が見つかりません")
+    if "店舗ID" in df.columns:
+        by_market = {}
+        for url, sid in zip(df[url_col], df["店舗ID"]):
+            if pd.notna(url) and pd.notna(sid):
+                by_market.setdefault(market_from_url(str(url)), []).append((shop_name_from_url(str(url)), sid))
+        for market, pairs in by_market.items():
+            get_runtime().shop_index.remember(pairs, market)
+    return df[url_col].dropna().tolist()
+
+def shop_asin_rows(shop_url: str, max_pages: Optional[int] = None, on_progress=None, incremental: bool = False) -> list:
+    """④ One row per item in the shop's full catalog with its resolved ASIN.
+
+    Catalog pages stream in from ``crawl_shop_async`` and each batch's ASINs are
+    resolved as it lands, so Amazon lookups overlap with the remaining page fetches;
+    ``on_progress(done, total)`` counts finished items against the shop's item
+    count. ``incremental`` refetches only the catalog pages that changed since the
+    shop's last run and looks up ASINs only for new or retitled items. The market
+    is read off the URL's site.
+    """
+    shop_name = shop_name_from_url(shop_url)
+    market = market_from_url(shop_url)
+
+    # Resolve the shop ID once (index first), then crawl its catalog
+    found_id = resolve_shop_id(shop_name, market)
+    if not found_id:
+        log.warning(f"{shop_name}: 店舗IDが見つかりません")
+        return []
+    rt = get_runtime()
+    item_count = get_shop_info(found_id, market).get("item_count") or 0
+    base = MARKETS[market]["base"]
+
+    rows = []
+    for batch in rt.iterate(crawl_shop_async(found_id, item_count, max_pages, incremental, market)):
+        asins = resolve_asins([item.get("name", "") for item in batch], incremental=incremental)
+        for item in batch:
+            title = item.get("name", "")
+            asin, tier = asins[title]
+            rows.append({
+                "マーケット": market,
+                "店舗名": shop_name,
+                "店舗ID": found_id,
+                "店舗URL": shop_url,
+                "タイトル": title,
+                "商品URL": f"{base}/{shop_name}-i.{item.get('shopid','')}.{item.get('itemid','')}",
+                "Sold": item.get("historical_sold", 0),
+                "価格(¥)": item.get("price", 0) / 100000,
+                "通貨": MARKETS[market]["currency"],
+                "ASIN": asin or "",
+                "Amazon URL": f"{AMAZON_BASE}/dp/{asin}" if asin else "",
+                "ASIN取得元": tier,
+            })
+        if on_progress:
+            on_progress(len(rows), max(item_count, len(rows)))
+    return rows
+
+def sales_velocity(days: float = 7, limit: int = 500) -> pd.DataFrame:
+    """⑤ Shops of every market ranked by sold-per-day across the snapshots taken in the last ``days``."""
+    rows = get_runtime().history.shop_velocity(time.time() - days * 86400, limit)
+    df = pd.DataFrame(rows, columns=["店舗ID", "店舗名", "追跡商品数", "期間Sold数", "Sold/日", "初回観測", "最終観測", "マーケット"])
+    df["店舗名"] = df["店舗名"].astype("string")
+    bases = {code: market["base"] for code, market in MARKETS.items()}
+    df["店舗URL"] = df["マーケット"].map(bases).fillna(SHOPEE_BASE).astype("string") + "/" + df["店舗名"]
+    df["Sold/日"] = df["Sold/日"].round(1)
+    for col in ("初回観測", "最終観測"):
+        df[col] = pd.to_datetime(df[col], unit="s", utc=True)
+    return conform(df, "velocity")
+
+def shop_item_velocity(shop_id: int, days: float = 7, market: str = DEFAULT_MARKET) -> pd.DataFrame:
+    """⑤ Drill-down: one shop's items ranked by sold-per-day over the last ``days``."""
+    rows = get_runtime().history.item_velocity(shop_id, time.time() - days * 86400)
+    df = pd.DataFrame(rows, columns=["商品ID", "タイトル", "期間Sold数", "Sold/日", "価格(¥)", "初回観測", "最終観測"])
+    df["商品URL"] = f"{MARKETS[market]['base']}/product/{shop_id}/" + df["商品ID"].astype("string")
+    df["Sold/日"] = df["Sold/日"].round(1)
+    for col in ("初回観測", "最終観測"):
+        df[col] = pd.to_datetime(df[col], unit="s", utc=True)
+    return conform(df, "item_velocity")
+
+# ─────────────────────────────────────────────
+# Jobs
+# ─────────────────────────────────────────────
+
+class JobCancelled(Exception):
+    pass
+
+@contextmanager
+def job_status(store: JobStore, job_id: str):
+    store.set_status(job_id, "running")
+    try:
+        yield
+    except BaseException:
+        store.set_status(job_id, "interrupted")
+        raise
+    store.set_status(job_id, "done")
+
+def create_specialist_job(keywords: list, pages: int, **options) -> str:
+    return get_runtime().jobs.create("specialist", {"keywords": keywords, "pages": pages, **options})
+
+def run_specialist_job(job_id: str, on_event=None, on_progress=None):
+    """③ as a resumable job: every page, candidate and vetted shop is checkpointed.
+
+    Each keyword is researched in all of the job's ``markets`` option (default: the
+    default market) at once, each market on its own limiter, and the rows of every
+    market land in the one job tagged by マーケット.
+    Re-running an interrupted job skips finished keywords, reuses the stored
+    candidate list when the search stage had completed, and never re-vets a shop.
+    Shops whose fetches failed stay unchecked and the job ends interrupted, so
+    resuming it retries just those.
+    A ``dataset`` option appends the finished rows to that Parquet dataset, and a
+    ``force_refresh`` option bypasses the caches as in ``refreshing``.
+    ``on_event(keyword, kind, payload)`` sees the pipeline events and
+    ``on_progress(fraction, text)`` a summary after each one. The rows are read
+    back with ``job_frame``.
+    """
+    store = get_runtime().jobs
+    params = dict(store.get(job_id)["params"])
+    keywords = params.pop("keywords")
+    pages = params.pop("pages")
+    dataset = params.pop("dataset", None)
+    markets = params.pop("markets", None) or [DEFAULT_MARKET]
+    force_refresh = params.pop("force_refresh", False)
+
+    with job_status(store, job_id), refreshing(force_refresh):
+        failed = 0
+        for kw_idx, kw in enumerate(keywords):
+            if store.has(job_id, f"kw:{kw}"):
+                continue
+            # Checkpoint units are scoped per market, so each market resumes on its own
+            streams = {}
+            pages_done = {}
+            checked = 0
+            for market in markets:
+                vetted = {int(u.rsplit(":", 1)[1]) for u in store.units(job_id, scoped(market, f"shop:{kw}:"))}
+                candidates = None
+                if store.has(job_id, scoped(market, f"searched:{kw}")):
+                    candidates = list(store.units(job_id, scoped(market, f"cand:{kw}:")).values())
+                pages_done[market] = pages if candidates is not None else 0
+                checked += len(vetted)
+                streams[market] = specialist_shops_async(kw, pages, skip=vetted, candidates=candidates,
+                                                         market=market, **params)
+
+            failed_kw = 0
+            for market, (kind, payload) in get_runtime().iterate(merge_async(streams)):
+                if kind == "error":
+                    log.warning(f"API エラー ({MARKETS[market]['label']}): {payload}")
+                    raise payload
+                if kind == "candidate":
+                    store.mark(job_id, scoped(market, f"cand:{kw}:{payload['shop_id']}"), payload)
+                elif kind == "page":
+                    pages_done[market] = payload
+                    store.mark(job_id, scoped(market, f"page:{kw}:{payload}"))
+                elif kind == "searched":
+                    store.mark(job_id, scoped(market, f"searched:{kw}"))
+                elif kind == "shop":
+                    shop, row = payload
+                    checked += 1
+                    store.mark(job_id, scoped(market, f"shop:{kw}:{shop['shop_id']}"), rows=[row] if row else [])
+                elif kind == "failed":
+                    shop, exc = payload
+                    failed_kw += 1
+                    log.warning(f"{shop['shop_name']}: 取得に失敗しました ({exc})")
+                if on_event:
+                    on_event(kw, kind, payload)
+                if on_progress:
+                    total_pages = pages * len(markets)
+                    done = sum(pages_done.values())
+                    on_progress(
+                        (kw_idx + min(done / total_pages, 1.0)) / len(keywords),
+                        f"{kw} ({kw_idx+1}/{len(keywords)}) / ページ {done}/{total_pages} / 店舗チェック {checked} 件",
+                    )
+            if failed_kw:
+                failed += failed_kw
+            else:
+                store.mark(job_id, f"kw:{kw}")
+        if failed:
+            raise FetchError(f"{failed} 店舗の取得に失敗しました。再開すると未取得の店舗だけを再試行します")
+        if dataset:
+            append_dataset(job_frame(job_id), dataset)
+
+def create_asin_job(shop_urls: list, dataset: Optional[str] = None, incremental: bool = False,
+                    force_refresh: bool = False) -> str:
+    return get_runtime().jobs.create("asin", {"shop_urls": shop_urls, "dataset": dataset, "incremental": incremental,
+                                              "force_refresh": force_refresh})
+
+def run_asin_job(job_id: str, on_event=None, on_progress=None):
+    """④ as a resumable job, checkpointed per shop.
+
+    ``on_event(shop_url, rows)`` fires as each shop finishes and
+    ``on_progress(fraction, text)`` as its ASINs resolve. A shop whose fetches
+    failed is left for a resume, as in ``run_specialist_job``.
+    """
+    store = get_runtime().jobs
+    params = store.get(job_id)["params"]
+    shop_urls = params["shop_urls"]
+
+    with job_status(store, job_id), refreshing(params.get("force_refresh", False)):
+        failed = 0
+        for shop_idx, shop_url in enumerate(shop_urls):
+            if store.has(job_id, f"shop:{shop_url}"):
+                continue
+            name = shop_name_from_url(shop_url)
+            report = None
+            if on_progress:
+                on_progress(shop_idx / len(shop_urls), f"{name} ({shop_idx+1}/{len(shop_urls)}) 商品取得中...")
+
+                def report(done, total):
+                    on_progress(
+                        (shop_idx + done / total) / len(shop_urls),
+                        f"{name} ({shop_idx+1}/{len(shop_urls)}) / 商品 {done}/{total}",
+                    )
+            try:
+                rows = shop_asin_rows(shop_url, on_progress=report, incremental=params.get("incremental", False))
+            except FetchError as e:
+                failed += 1
+                log.warning(f"{name}: 取得に失敗しました ({e})")
+                continue
+            store.mark(job_id, f"shop:{shop_url}", rows=rows)
+            if on_event:
+                on_event(shop_url, rows)
+        if failed:
+            raise FetchError(f"{failed} 店舗の取得に失敗しました。再開すると未取得の店舗だけを再試行します")
+        if params.get("dataset"):
+            append_dataset(job_frame(job_id), params["dataset"])
+
+JOB_RUNNERS = {
+    "specialist": run_specialist_job,
+    "asin": run_asin_job,
+}
+
+class JobRunner:
+    """Runs stored jobs on worker threads, independent of the session that started them.
+
+    Every job shares the runtime's rate limiters, so several can run side by side.
+    Progress, including the job's ``RunStats``, lives in memory; rows are read
+    back from the ``JobStore``.
+    """
+
+    def __init__(self, store: JobStore, max_workers: int = 4):
+        self.store = store
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shopee-job")
+        self._lock = threading.Lock()
+        self._running = set()
+        self._cancelled = set()
+        self._progress = {}
+
+    def submit(self, job_id: str):
+        with self._lock:
+            if job_id in self._running:
+                return
+            self._running.add(job_id)
+            self._cancelled.discard(job_id)
+            self._progress[job_id] = {"fraction": 0.0, "text": "待機中...", "error": None, "stats": None}
+        self._pool.submit(self._run, job_id)
+
+    def cancel(self, job_id: str):
+        with self._lock:
+            self._cancelled.add(job_id)
+
+    def is_running(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._running
+
+    def active(self, kind: Optional[str] = None) -> list:
+        with self._lock:
+            running = list(self._running)
+        return [j for j in running if kind is None or self.store.get(j)["kind"] == kind]
+
+    def progress(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            p = self._progress.get(job_id)
+            return dict(p) if p else None
+
+    def _report(self, job_id: str, fraction: float, text: str):
+        with self._lock:
+            if job_id in self._cancelled:
+                raise JobCancelled(job_id)
+            self._progress[job_id].update(fraction=min(max(fraction, 0.0), 1.0), text=text)
+
+    def _run(self, job_id: str):
+        try:
+            kind = self.store.get(job_id)["kind"]
+            with track_run(f"{kind} {job_id}") as stats:
+                with self._lock:
+                    self._progress[job_id]["stats"] = stats
+                JOB_RUNNERS[kind](job_id, on_progress=lambda fraction, text: self._report(job_id, fraction, text))
+            self._report(job_id, 1.0, "完了")
+        except JobCancelled:
+            with self._lock:
+                self._progress[job_id]["text"] = "停止しました"
+        except Exception as e:
+            log.exception(f"job {job_id} failed")
+            with self._lock:
+                self._progress[job_id]["error"] = str(e)
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+                self._cancelled.discard(job_id)
+
+# ─────────────────────────────────────────────
+# Result Tables & Export
+# ─────────────────────────────────────────────
+
+# Fixed column order and dtypes per row kind, shared by every exporter. Prices are
+# in the row's market currency; the 価格(¥) name is kept for existing exports and jobs.
+SCHEMAS = {
+    "item": {
+        "market": "string",
+        "shop_name": "string",
+        "shop_id": "Int64",
+        "shop_url": "string",
+        "item_id": "Int64",
+        "item_url": "string",
+        "title": "string",
+        "sold": "Int64",
+        "price": "Float64",
+        "currency": "string",
+        "is_preferred": "boolean",
+        "location": "string",
+        "asin": "string",
+        "asin_source": "string",
+        "amazon_url": "string",
+    },
+    "shop": {
+        "マーケット": "string",
+        "店舗名": "string",
+        "店舗ID": "Int64",
+        "店舗URL": "string",
+        "Preferred": "string",
+        "地域": "string",
+        "総Sold数": "Int64",
+        "商品数": "Int64",
+    },
+    "specialist": {
+        "マーケット": "string",
+        "検索キーワード": "string",
+        "店舗名": "string",
+        "店舗ID": "Int64",
+        "店舗URL": "string",
+        "Preferred": "string",
+        "カテゴリ数": "Int64",
+        "Amazon比率": "Float64",
+        "商品数": "Int64",
+        "フォロワー数": "Int64",
+        "レビュー数": "Int64",
+        "評価": "Float64",
+    },
+    "velocity": {
+        "マーケット": "string",
+        "店舗名": "string",
+        "店舗ID": "Int64",
+        "店舗URL": "string",
+        "Sold/日": "Float64",
+        "期間Sold数": "Int64",
+        "追跡商品数": "Int64",
+        "初回観測": "datetime64[ns, UTC]",
+        "最終観測": "datetime64[ns, UTC]",
+    },
+    "item_velocity": {
+        "タイトル": "string",
+        "商品URL": "string",
+        "Sold/日": "Float64",
+        "期間Sold数": "Int64",
+        "価格(¥)": "Float64",
+        "初回観測": "datetime64[ns, UTC]",
+        "最終観測": "datetime64[ns, UTC]",
+    },
+    "asin": {
+        "マーケット": "string",
+        "店舗名": "string",
+        "店舗ID": "Int64",
+        "店舗URL": "string",
+        "タイトル": "string",
+        "商品URL": "string",
+        "Sold": "Int64",
+        "価格(¥)": "Float64",
+        "通貨": "string",
+        "ASIN": "string",
+        "Amazon URL": "string",
+        "ASIN取得元": "string",
+    },
+}
+
+def conform(df: pd.DataFrame, kind: str) -> pd.DataFrame:
+    """``df`` with exactly the schema's columns, in order and with its dtypes."""
+    schema = SCHEMAS[kind]
+    df = df.reindex(columns=list(schema))
+    return df.astype(schema)
+
+class ResultTable:
+    """Chunked columnar accumulator for one row kind.
+
+    Each ``append`` converts its rows to a typed frame right away, so a long run
+    holds columns rather than millions of dicts; ``frame`` concatenates lazily.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._chunks = []
+        self._rows = 0
+
+    def append(self, rows):
+        if len(rows) == 0:
+            return
+        chunk = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame.from_records(rows)
+        self._chunks.append(conform(chunk, self.kind))
+        self._rows += len(chunk)
+
+    def frame(self) -> pd.DataFrame:
+        if not self._chunks:
+            return conform(pd.DataFrame(), self.kind)
+        if len(self._chunks) > 1:
+            self._chunks = [pd.concat(self._chunks, ignore_index=True)]
+        return self._chunks[0]
+
+    def __len__(self) -> int:
+        return self._rows
+
+def job_frame(job_id: str, chunk_size: int = 5000) -> pd.DataFrame:
+    """A job's rows as a typed frame, read and converted ``chunk_size`` rows at a time."""
+    store = get_runtime().jobs
+    table = ResultTable(store.get(job_id)["kind"])
+    for rows in store.iter_rows(job_id, chunk_size):
+        table.append(rows)
+    df = table.frame()
+    # Rows stored before markets existed are all default-market
+    df["マーケット"] = df["マーケット"].fillna(DEFAULT_MARKET)
+    if "通貨" in df.columns:
+        df["通貨"] = df["通貨"].fillna(df["マーケット"].map({code: m["currency"] for code, m in MARKETS.items()}))
+    return df
+
+def to_csv(df: pd.DataFrame) -> bytes:
+    with stage("export"):
+        return df.to_csv(index=False, encoding="utf-8-sig").encode("utf-8-sig")
+
+def to_parquet(df: pd.DataFrame) -> bytes:
+    if pyarrow is None:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+    buf = io.BytesIO()
+    with stage("export"):
+        df.to_parquet(buf, index=False, compression="zstd")
+    return buf.getvalue()
+
+def append_dataset(df: pd.DataFrame, name: str) -> Path:
+    """Add ``df`` as a new part file of the Parquet dataset ``name``; returns the part's path.
+
+    Every part is kept in the schema of the newest result, so readers can load the
+    whole dataset with ``pd.read_parquet(DATA_DIR / "datasets" / name)``. Parts
+    written before columns were added are rewritten with those columns empty; a
+    result that doesn't fit the dataset's columns raises ``ValueError``.
+    """
+    folder = DATA_DIR / "datasets" / name
+    folder.mkdir(parents=True, exist_ok=True)
+    data = to_parquet(df)
+    schema = pyarrow.parquet.read_schema(io.BytesIO(data))
+    # Convert every stale part before touching any, so a mismatch leaves the dataset as it was
+    migrated = {part: _migrate_part(part, schema) for part in sorted(folder.glob("*.parquet"))
+                if not pyarrow.parquet.read_schema(part).equals(schema, check_metadata=False)}
+    for part, part_data in migrated.items():
+        # Dot files are skipped by dataset readers, so a reader never sees a half-written part
+        tmp = part.with_name(f".{part.name}.tmp")
+        tmp.write_bytes(part_data)
+        os.replace(tmp, part)
+    path = folder / f"part-{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(3).hex()}.parquet"
+    path.write_bytes(data)
+    return path
+
+def _migrate_part(part: Path, schema) -> bytes:
+    """An older dataset part converted to ``schema``, its missing columns empty."""
+    old = pyarrow.parquet.read_table(part)
+    extra = [col for col in old.column_names if col not in schema.names]
+    if extra:
+        raise ValueError(f"{part.parent.name}: {part.name} has columns this result lacks ({', '.join(extra)}); "
+                         "append to a new dataset instead")
+    # Only columns that were entirely empty may change type; anything else would rewrite old data
+    changed = [f"{field.name}: {field.type} → {schema.field(field.name).type}" for field in old.schema
+               if field.type != schema.field(field.name).type and not pyarrow.types.is_null(field.type)]
+    if changed:
+        raise ValueError(f"{part.parent.name}: {part.name} has other column types ({', '.join(changed)}); "
+                         "append to a new dataset instead")
+    columns = [old[field.name] if field.name in old.column_names else pyarrow.nulls(old.num_rows, field.type)
+               for field in schema]
+    table = pyarrow.table(columns, names=schema.names).cast(schema)
+    buf = io.BytesIO()
+    pyarrow.parquet.write_table(table, buf, compression="zstd")
+    return buf.getvalue()
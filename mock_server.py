@@ -0,0 +1,232 @@
+"""Local stand-in for the Shopee and Amazon endpoints the engine calls.
+
+    python mock_server.py --port 8765 --latency 0.05 --error-rate 0.02
+    SHOPEE_BASE_URL=http://127.0.0.1:8765 AMAZON_BASE_URL=http://127.0.0.1:8765 streamlit run app.py
+
+Responses are synthetic but deterministic (the same request always gets the same
+data), or replayed from a response cache the tool recorded earlier (``--replay
+.shopee_research/http_cache.sqlite``). Other markets are served under a path
+prefix, e.g. ``SHOPEE_BASE_URL_SG=http://127.0.0.1:8765/sg``. ``bench.py`` starts
+one in-process.
+"""
+import argparse
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+API_PREFIX = "/api/v4"
+SEARCH_RESULTS = 540
+SHOPS_PER_QUERY = 40
+# Queries draw their shops from one pool so shops recur across keywords, as they do live
+SHOP_POOL = range(1000, 1400)
+MARKET_PATH = re.compile(r"/([a-z]{2})(/.*)")
+CATEGORIES = [100001, 100002, 100003, 100004, 100005]
+# Every top-level category has SUBCATEGORIES children with LEAVES leaves each
+SUBCATEGORIES = 4
+LEAVES = 3
+
+def market_offset(market: str) -> int:
+    """Shop IDs of a prefixed market are shifted, as Shopee IDs are unique across markets."""
+    return (zlib.crc32(market.encode()) % 90 + 10) * 10000 if market else 0
+
+def category_tree() -> dict:
+    """Three levels under ``CATEGORIES``; child IDs extend their parent's with one digit."""
+    def node(cat_id: int, parent: int, name: str, children: list) -> dict:
+        return {"catid": cat_id, "parent_catid": parent, "name": name, "display_name": name, "children": children}
+
+    tree = []
+    for top in CATEGORIES:
+        subs = []
+        for sub in range(1, SUBCATEGORIES + 1):
+            sub_id = top * 10 + sub
+            leaves = [node(sub_id * 10 + leaf, sub_id, f"Leaf {sub}-{leaf}", []) for leaf in range(1, LEAVES + 1)]
+            subs.append(node(sub_id, top, f"Sub {sub}", leaves))
+        tree.append(node(top, 0, f"Category {top}", subs))
+    return {"data": {"category_list": tree}}
+
+def search_items(seed: str, newest: int, limit: int, market: str = "") -> dict:
+    """One page of a sales-ranked search: ``SEARCH_RESULTS`` items spread over ``SHOPS_PER_QUERY`` shops."""
+    seed = f"{market}:{seed}" if market else seed
+    offset = market_offset(market)
+    shops = [offset + sid for sid in random.Random(f"shops:{seed}").sample(SHOP_POOL, SHOPS_PER_QUERY)]
+    items = []
+    for rank in range(newest, min(newest + limit, SEARCH_RESULTS)):
+        rng = random.Random(f"{seed}:{rank}")
+        shop_id = rng.choice(shops)
+        items.append({"item_basic": {
+            "shopid": shop_id,
+            "shop_name": f"shop{shop_id}",
+            "itemid": shop_id * 100000 + rng.randrange(100000),
+            "name": listing_title(shop_id, rank),
+            "historical_sold": max(1, 5000 - rank * 9),
+            "price": rng.randint(500, 20000) * 100000,
+            "is_preferred_plus_seller": shop_id % 4 == 0,
+            "shop_location": "Japan" if shop_id % 7 else "Korea",
+        }})
+    return {"items": items}
+
+def listing_title(shop_id: int, index: int) -> str:
+    """Even shop IDs source from Amazon: most of their titles carry an ASIN or the word.
+
+    Other titles come from a small vocabulary, so Amazon lookups repeat the way
+    they do across real catalogs.
+    """
+    rng = random.Random(f"title:{shop_id}:{index}")
+    words = " ".join(rng.choice(["golf", "グローブ", "ボール", "セット", "新品", "送料無料", "正規品"]) for _ in range(4))
+    if shop_id % 2 == 0 and rng.random() < 0.6:
+        return f"{words} B0{rng.randrange(16 ** 8):08X}"
+    if shop_id % 2 == 0 and rng.random() < 0.5:
+        return f"{words} Amazon"
+    return words
+
+def shop_detail(shop_id: int) -> dict:
+    rng = random.Random(f"shop:{shop_id}")
+    return {"data": {
+        "shopid": shop_id,
+        "username": f"shop{shop_id}",
+        "item_count": rng.randint(20, 400),
+        "follower_count": rng.randint(0, 50000),
+        "rating_count": rng.randint(0, 20000),
+        "rating_star": round(rng.uniform(3.5, 5.0), 2),
+    }}
+
+def shop_items(shop_id: int, offset: int, limit: int) -> dict:
+    """A slice of the shop's catalog; shop IDs divisible by 3 stay in one category."""
+    total = shop_detail(shop_id)["data"]["item_count"]
+    items = []
+    for index in range(offset, min(offset + limit, total)):
+        rng = random.Random(f"item:{shop_id}:{index}")
+        catid = CATEGORIES[shop_id % len(CATEGORIES)] if shop_id % 3 == 0 else rng.choice(CATEGORIES)
+        items.append({
+            "shopid": shop_id,
+            "itemid": shop_id * 100000 + index,
+            "name": listing_title(shop_id, index),
+            "historical_sold": max(0, 2000 - index * 3),
+            "price": rng.randint(500, 20000) * 100000,
+            "categories": [{"catid": catid}],
+        })
+    return {"items": items}
+
+def amazon_search(query: str) -> str:
+    """Search results page; seven in ten queries find an ASIN."""
+    rng = random.Random(f"amazon:{query}")
+    if rng.random() < 0.7:
+        return f'<html><a href="/dp/B0{rng.randrange(16 ** 8):08X}/ref=sr_1_1">result</a></html>'
+    return "<html>no results</html>"
+
+class Replay:
+    """Bodies recorded in a ``ResponseCache`` database, looked up by the same key."""
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def get(self, endpoint: str, params: dict, market: str = ""):
+        normalized = {k: str(v) for k, v in params.items() if v is not None}
+        key = endpoint + "?" + json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+        key = f"{market}:{key}" if market else key
+        with self._lock:
+            row = self._db.execute("SELECT body FROM responses WHERE key = ?", (key,)).fetchone()
+        return zlib.decompress(row[0]) if row else None
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Set by serve()
+    latency = 0.0
+    error_rate = 0.0
+    replay = None
+    stats = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        rng = random.Random()
+        if self.latency:
+            time.sleep(rng.expovariate(1 / self.latency))
+        self.stats["requests"] += 1
+        if rng.random() < self.error_rate:
+            self.stats["errors"] += 1
+            status = rng.choice([429, 503])
+            return self.send(status, b"{}", "application/json", {"Retry-After": "1"} if status == 429 else {})
+
+        path = url.path
+        if path == "/s":
+            return self.send(200, amazon_search(params.get("k", "")).encode(), "text/html")
+        market = ""
+        if match := MARKET_PATH.fullmatch(path):
+            market, path = match.groups()
+        if not path.startswith(API_PREFIX):
+            return self.send(404, b"{}", "application/json")
+        endpoint = path[len(API_PREFIX):]
+        body = self.replay.get(endpoint, params, market) if self.replay else None
+        if body is None:
+            data = self.synthetic(endpoint, params, market)
+            if data is None:
+                return self.send(404, b"{}", "application/json")
+            body = json.dumps(data, ensure_ascii=False).encode()
+        self.send(200, body, "application/json")
+
+    @staticmethod
+    def synthetic(endpoint: str, params: dict, market: str = ""):
+        limit = int(params.get("limit", 60))
+        if endpoint == "/search/search_items/":
+            seed = params.get("keyword") or f"cat{params.get('catid')}"
+            return search_items(seed, int(params.get("newest", 0)), limit, market)
+        if endpoint == "/shop/get_shop_detail/":
+            if "username" in params:
+                match = re.fullmatch(r"shop(\d+)", params["username"])
+                return shop_detail(int(match.group(1))) if match else {"error": 4, "data": None}
+            return shop_detail(int(params["shopid"]))
+        if endpoint == "/recommend/recommend_items/":
+            return shop_items(int(params["shopid"]), int(params.get("offset", 0)), limit)
+        if endpoint == "/pages/get_category_tree":
+            return category_tree()
+        return None
+
+    def send(self, status: int, body: bytes, content_type: str, headers: dict = {}):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port: int = 0, latency: float = 0.0, error_rate: float = 0.0, replay: str = None) -> ThreadingHTTPServer:
+    """Start the server on a daemon thread; ``server.server_address`` has the bound port."""
+    handler = type("MockHandler", (Handler,), {
+        "latency": latency,
+        "error_rate": error_rate,
+        "replay": Replay(replay) if replay else None,
+        "stats": {"requests": 0, "errors": 0},
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-server", daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Shopee/Amazon stand-in server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean response delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered 429/503")
+    parser.add_argument("--replay", metavar="SQLITE", help="serve bodies recorded in this response cache first")
+    args = parser.parse_args(argv)
+    server = serve(args.port, args.latency, args.error_rate, args.replay)
+    print(f"listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Engine checks against the local stand-in server.
+
+    python -m pytest -q
+
+The engine reads its base URLs and data directory at import, so they are set
+before ``engine`` is imported.
+"""
+import os
+import tempfile
+
+import mock_server
+
+server = mock_server.serve(0)
+base = f"http://127.0.0.1:{server.server_address[1]}"
+os.environ["SHOPEE_BASE_URL"] = base
+os.environ["SHOPEE_API_URL"] = f"{base}/api/v4"
+os.environ["AMAZON_BASE_URL"] = base
+os.environ["SHOPEE_RESEARCH_DIR"] = tempfile.mkdtemp(prefix="shopee-test-")
+import engine  # noqa: E402
+
+engine.get_runtime().configure_shopee(200, 20)
+
+def search(keyword: str, pages: int, incremental: bool) -> int:
+    return len(engine.keyword_search(keyword, pages, japan_only=False, min_sold=0, incremental=incremental))
+
+def test_incremental_fetches_pages_past_the_stored_run():
+    full = search("golf", 5, incremental=False)
+    assert search("golf", 1, incremental=True) < full
+    assert search("golf", 5, incremental=True) == full
+
+def test_incremental_refetches_a_stale_baseline():
+    history = engine.get_runtime().history
+    run_key = engine.scoped(engine.DEFAULT_MARKET, "keyword:ball")
+    search("ball", 2, incremental=True)
+    search("ball", 2, incremental=True)
+    assert history.last_run(run_key) is not None
+    with history._lock:
+        history._db.execute("UPDATE query_runs SET oldest_at = oldest_at - ? WHERE run_key = ?",
+                            (engine.RUN_MAX_AGE + 1, run_key))
+    assert history.last_run(run_key) is None
+    search("ball", 2, incremental=True)
+    _, pages, oldest_at = history.last_run(run_key)
+    assert pages == 2 and oldest_at > engine.time.time() - 60